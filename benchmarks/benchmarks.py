@@ -0,0 +1,173 @@
+"""
+Benchmarks for airspeed velocity (asv), run with ``asv run`` in the repository's root.
+Archives are generated with :py:mod:`jpkfile.synthetic` in ``setup_cache``.
+"""
+import os
+from zipfile import ZIP_STORED, ZIP_DEFLATED
+import numpy as np
+import jpkfile
+from jpkfile import jpkfile as jpk
+from jpkfile.synthetic import write_synthetic_archive, get_segment_header
+
+COMPRESSIONS = {'stored': ZIP_STORED, 'deflated': ZIP_DEFLATED}
+CHANNELS = ('height', 'vDeflection', 'strainGaugeHeight', 'hDeflection', 'error')
+
+
+def write_archives(kinds, **kwargs):
+    # Writes one archive per kind and compression, returns their absolute paths.
+    paths = {}
+    for kind in kinds:
+        for compression, compress_type in COMPRESSIONS.items():
+            fname = os.path.abspath('synthetic-%s.jpk-%s' % (compression, kind))
+            write_synthetic_archive(fname, compression=compress_type, **kwargs)
+            paths[kind, compression] = fname
+    return paths
+
+
+class FileSuite:
+    params = (['force', 'nt-force'], ['stored', 'deflated'])
+    param_names = ['kind', 'compression']
+    timeout = 300
+
+    def setup_cache(self):
+        return write_archives(['force', 'nt-force'], num_segments=5, num_points=100000,
+                              channels=CHANNELS)
+
+    def setup(self, paths, kind, compression):
+        self.fname = paths[kind, compression]
+        self.jpk_file = jpkfile.JPKFile(self.fname)
+
+    def time_open(self, paths, kind, compression):
+        jpkfile.JPKFile(self.fname)
+
+    def time_open_lazy(self, paths, kind, compression):
+        jpkfile.JPKFile(self.fname, lazy=True)
+
+    def time_open_memory_mapped(self, paths, kind, compression):
+        jpkfile.JPKFile(self.fname, memory_map=True)
+
+    def time_get_decoded_data(self, paths, kind, compression):
+        for segment in self.jpk_file.segments.values():
+            segment.get_decoded_data('vDeflection')
+
+    def time_get_array(self, paths, kind, compression):
+        self.jpk_file.get_array(['height', 'vDeflection'])
+
+    def time_get_array_float32_2d(self, paths, kind, compression):
+        self.jpk_file.get_array(['height', 'vDeflection'], dtype=np.float32, layout='2d')
+
+    def peakmem_open(self, paths, kind, compression):
+        jpkfile.JPKFile(self.fname)
+
+    def peakmem_get_array(self, paths, kind, compression):
+        self.jpk_file.get_array(list(CHANNELS))
+
+
+class MapSuite:
+    params = (['stored', 'deflated'], [False, True])
+    param_names = ['compression', 'shared_header']
+    timeout = 600
+
+    def setup_cache(self):
+        paths = {}
+        for shared_header in (False, True):
+            # Non-square grid, so that mixing up rows and columns of pixels shows.
+            archives = write_archives(['force-map'], num_pixels=(16, 12), num_segments=2,
+                                      num_points=2000, channels=CHANNELS,
+                                      shared_header=shared_header)
+            for (kind, compression), fname in archives.items():
+                new_fname = fname.replace('.jpk', '-%s.jpk' % ('shared' if shared_header
+                                                                else 'local'))
+                os.replace(fname, new_fname)
+                paths[compression, shared_header] = new_fname
+        return paths
+
+    def setup(self, paths, compression, shared_header):
+        self.fname = paths[compression, shared_header]
+
+    def time_open(self, paths, compression, shared_header):
+        jpkfile.JPKMap(self.fname)
+
+    def time_open_lazy(self, paths, compression, shared_header):
+        jpkfile.JPKMap(self.fname, lazy=True)
+
+    def time_get_cube(self, paths, compression, shared_header):
+        jpkfile.JPKMap(self.fname, lazy=True).get_cube('vDeflection', 0)
+
+    def peakmem_get_cube(self, paths, compression, shared_header):
+        jpkfile.JPKMap(self.fname, lazy=True).get_cube('vDeflection', 0)
+
+    def peakmem_open(self, paths, compression, shared_header):
+        jpkfile.JPKMap(self.fname)
+
+
+class HeaderSuite:
+    params = [False, True]
+    param_names = ['cached']
+
+    def setup(self, cached):
+        self.content = get_segment_header('extend', 10000, CHANNELS, False).encode('utf-8')
+        jpk.parse_header_file(self.content)
+
+    def time_parse_header_file(self, cached):
+        if not cached:
+            jpk._split_headers.clear()
+            jpk._header_layouts.clear()
+        jpk.parse_header_file(self.content)
+
+
+class ExtractDataSuite:
+    params = [sorted(jpk.DATA_TYPES)]
+    param_names = ['dtype']
+
+    def setup(self, dtype):
+        self.num_points = 10 ** 6
+        self.content = bytes(jpk.DATA_TYPES[dtype][0] * self.num_points)
+
+    def time_extract_data(self, dtype):
+        jpk.extract_data(self.content, dtype, self.num_points)
+
+    def time_extract_and_decode(self, dtype):
+        data = jpk.extract_data(self.content, dtype, self.num_points)
+        data * 1.5 + 0.5
+
+
+class EnvelopeSuite:
+    timeout = 300
+
+    def setup_cache(self):
+        return write_archives(['nt-force'], num_segments=1, num_points=10 ** 7)
+
+    def setup(self, paths):
+        self.fname = paths['nt-force', 'stored']
+        self.segment = jpkfile.JPKFile(self.fname, lazy=True).segments[0]
+        self.segment.get_envelope('vDeflection')
+
+    def time_build_pyramid(self, paths):
+        jpkfile.MinMaxPyramid(self.segment.data['vDeflection'][0])
+
+    def time_get_envelope(self, paths):
+        self.segment.get_envelope('vDeflection', 100.0, 600.0, 2000)
+
+    def time_decode_and_downsample(self, paths):
+        # What `get_envelope` replaces: decoding all points and reducing them afterwards.
+        data = self.segment.get_decoded_data('vDeflection')[0][:, 0]
+        n = len(data) // 5000 * 5000
+        data[:n].reshape(-1, 5000).min(axis=1)
+
+
+class PreprocessingSuite:
+    timeout = 300
+
+    def setup_cache(self):
+        return write_archives(['force-map'], num_pixels=(32, 32), num_segments=2,
+                              num_points=2000)
+
+    def setup(self, paths):
+        jpk_map = jpkfile.JPKMap(paths['force-map', 'stored'], lazy=True)
+        self.height, _, self.lengths = jpk_map.get_cube('height', 0)
+        self.deflection = jpk_map.get_cube('vDeflection', 0,
+                                           conversions_to_be_applied=['distance'])[0]
+
+    def time_preprocess_curves(self, paths):
+        jpkfile.preprocess_curves(self.height, self.deflection, lengths=self.lengths)
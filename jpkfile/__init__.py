@@ -1 +1,9 @@
 from .jpkfile import *
+from .cache import DecodedDataCache
+from .stats import LoadStats
+from .pyramid import MinMaxPyramid
+from .catalog import JPKCatalog
+from .streaming import iter_segments
+from .export import export_archive, convert_archives
+from .preprocessing import preprocess_map, preprocess_files, preprocess_curves
+from .aio import AsyncLoader, open_async, iter_segments_async
@@ -0,0 +1,115 @@
+"""
+Loading of JPK archives from :py:mod:`asyncio` code. Reading archives (inflating and
+decoding data) is done in an executor, so that the event loop is not blocked, with
+a bounded number of concurrent jobs, see :py:class:`AsyncLoader`.
+"""
+import asyncio
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from .jpkfile import JPKFile, JPKMap
+from .streaming import iter_segments
+
+# Default loaders by event loop, see `get_default_loader`.
+_default_loaders = weakref.WeakKeyDictionary()
+_END = object()
+
+
+class AsyncLoader:
+    """
+    Runs the (blocking) reading of archives in an executor and limits the number of
+    jobs running at the same time, so that bulk loading does not starve other coroutines
+    or exhaust memory. Zip inflation and numpy operations release the GIL, so reading
+    in threads (default) runs in parallel to some degree.
+
+    :param max_concurrency: Maximum number of jobs running at the same time.
+    :type max_concurrency: int
+    :param executor: Executor to run jobs in. By default, a
+     :py:class:`~concurrent.futures.ThreadPoolExecutor` with `max_concurrency`
+     threads is created.
+    """
+    def __init__(self, max_concurrency=4, executor=None):
+        """Constructor."""
+        #: Maximum number of jobs running at the same time.
+        self.max_concurrency = max_concurrency
+        #: Executor jobs are run in.
+        self.executor = executor if executor is not None else ThreadPoolExecutor(max_concurrency)
+        self._semaphore = None
+
+    async def run(self, func, *args, **kwargs):
+        """Calls `func` with `args` and `kwargs` in :py:attr:`executor`, as soon as fewer
+        than :py:attr:`max_concurrency` jobs are running, and returns its result."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def open(self, fname, **kwargs):
+        """
+        Opens an archive, see :py:func:`open_async`.
+
+        :return: :py:class:`~jpkfile.JPKMap` for paths ending on '.jpk-force-map',
+         :py:class:`~jpkfile.JPKFile` otherwise.
+        """
+        cls = JPKMap if str(fname).endswith('.jpk-force-map') else JPKFile
+        return await self.run(cls, fname, **kwargs)
+
+    async def open_many(self, fnames, **kwargs):
+        """Opens many archives concurrently (at most :py:attr:`max_concurrency` at a
+        time) and returns them in the order of `fnames`."""
+        return await asyncio.gather(*[self.open(fname, **kwargs) for fname in fnames])
+
+    async def get_array(self, jpk_object, *args, **kwargs):
+        """Calls ``jpk_object.get_array(*args, **kwargs)`` in the executor, for
+        :py:class:`~jpkfile.JPKFile` or :py:class:`~jpkfile.JPKSegment` objects."""
+        return await self.run(jpk_object.get_array, *args, **kwargs)
+
+    async def iter_segments(self, paths, **kwargs):
+        """
+        Asynchronous counterpart of :py:func:`~jpkfile.iter_segments` (which see for the
+        parameters): reading and decoding of each segment is done in the executor.
+        Use as ``async for path, index, arrays, units, parameters in loader.iter_segments(...)``.
+        """
+        segments = iter_segments(paths, **kwargs)
+        try:
+            while True:
+                item = await self.run(next, segments, _END)
+                if item is _END:
+                    return
+                yield item
+        finally:
+            # Closes the current archive.
+            await self.run(segments.close)
+
+    def shutdown(self, wait=True):
+        """Shuts down :py:attr:`executor`."""
+        self.executor.shutdown(wait=wait)
+
+
+def get_default_loader():
+    """Returns the :py:class:`AsyncLoader` used by the module level functions
+    in the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    loader = _default_loaders.get(loop)
+    if loader is None:
+        loader = _default_loaders[loop] = AsyncLoader()
+    return loader
+
+
+async def open_async(fname, **kwargs):
+    """
+    Opens an archive without blocking the event loop, e.g.
+    ``jpk_file = await jpkfile.open_async(path, lazy=True)``.
+
+    :param fname: Path to the archive; force maps are opened as :py:class:`~jpkfile.JPKMap`,
+     all other archives as :py:class:`~jpkfile.JPKFile`.
+    :param kwargs: Passed on to :py:class:`~jpkfile.JPKFile` or :py:class:`~jpkfile.JPKMap`.
+    """
+    return await get_default_loader().open(fname, **kwargs)
+
+
+def iter_segments_async(paths, **kwargs):
+    """Asynchronous counterpart of :py:func:`~jpkfile.iter_segments`, see
+    :py:meth:`AsyncLoader.iter_segments`."""
+    return get_default_loader().iter_segments(paths, **kwargs)
@@ -0,0 +1,115 @@
+"""On-disk cache for decoded channel data, see :py:class:`DecodedDataCache`."""
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+
+
+class DecodedDataCache:
+    """
+    Stores decoded data of channels (as returned by ``JPKSegment.get_decoded_data``)
+    in a directory, one ``.npy`` file per channel and segment, so that archives do not
+    have to be read and decoded again in later sessions. Cached data is loaded
+    memory mapped (read-only).
+    Pass an instance to :py:class:`~jpkfile.JPKFile` or :py:class:`~jpkfile.JPKMap` to use it.
+    Entries are identified by path, size and modification time of the archive, by pixel,
+    segment and channel, and by the conversions applied. If the total size of the
+    cache exceeds `max_bytes`, least recently used entries are removed.
+
+    :param directory: Directory to store cached data in. It is created if it does not exist.
+    :type directory: str
+    :param max_bytes: Maximum total size of cached data in bytes.
+    :type max_bytes: int
+    """
+    def __init__(self, directory, max_bytes=2 ** 30):
+        """Constructor."""
+        #: Directory cached data is stored in.
+        self.directory = os.path.abspath(directory)
+        #: Maximum total size of cached data in bytes.
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        self._size = sum(size for _, _, size in self._list_entries())
+
+    def get_key(self, fingerprint, *identifiers):
+        """Returns the name of the cache entry for an archive `fingerprint` (see
+        :py:func:`archive_fingerprint`) and further identifiers."""
+        return hashlib.sha1(repr((fingerprint,) + identifiers).encode('utf-8')).hexdigest()
+
+    def load(self, key):
+        """
+        Returns cached data for `key`, or ``None`` if nothing is cached.
+
+        :return: Tuple with 2 items: (1) read-only memory mapped numpy array;
+         (2) unit of data.
+        """
+        npy, meta = self._paths(key)
+        try:
+            data = np.load(npy, mmap_mode='r')
+            with open(meta) as f:
+                unit = json.load(f)['unit']
+        except (OSError, ValueError, KeyError):
+            return None
+        # The modification time marks when an entry was last used.
+        try:
+            os.utime(npy)
+        except OSError:
+            pass
+        return data, unit
+
+    def store(self, key, data, unit):
+        """Stores `data` (numpy array) with `unit` under `key`, and removes least
+        recently used entries if the cache grew larger than :py:attr:`max_bytes`."""
+        npy, meta = self._paths(key)
+        with open(meta, 'w') as f:
+            json.dump({'unit': unit}, f)
+        # Written under a temporary name first, so that other processes (or threads)
+        # never see incomplete files.
+        tmp = npy + '.%i.%i.tmp' % (os.getpid(), threading.get_ident())
+        with open(tmp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(data))
+        os.replace(tmp, npy)
+        self._size += os.path.getsize(npy)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the cache is not larger than
+        :py:attr:`max_bytes`."""
+        entries = sorted(self._list_entries())
+        self._size = sum(size for _, _, size in entries)
+        for _, key, size in entries:
+            if self._size <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._size -= size
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        self.max_bytes, max_bytes = 0, self.max_bytes
+        self.evict()
+        self.max_bytes = max_bytes
+
+    def _paths(self, key):
+        path = os.path.join(self.directory, key)
+        return path + '.npy', path + '.json'
+
+    def _list_entries(self):
+        # Tuples (time of last use, key, size) of all entries.
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npy'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        return entries
+
+
+def archive_fingerprint(path):
+    """Returns tuple (absolute path, size, modification time) identifying
+    the current state of the archive at `path`."""
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime
@@ -0,0 +1,222 @@
+"""Catalog of segment metadata of many JPK archives, stored in a SQLite database.
+Only header files are read to build the catalog; no data is decoded."""
+import os
+import glob
+import sqlite3
+import warnings
+from .jpkfile import JPKFile, JPKMap
+
+#: File extensions of archives that are added to a catalog when scanning directories.
+ARCHIVE_EXTENSIONS = ('.jpk-force', '.jpk-nt-force', '.jpk-force-map')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archives (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    kind TEXT NOT NULL,
+    num_pixels INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS segments (
+    path TEXT NOT NULL REFERENCES archives(path) ON DELETE CASCADE,
+    pixel INTEGER NOT NULL,
+    segment INTEGER NOT NULL,
+    type TEXT,
+    num_points INTEGER,
+    duration REAL,
+    PRIMARY KEY (path, pixel, segment)
+);
+CREATE TABLE IF NOT EXISTS channels (
+    path TEXT NOT NULL,
+    pixel INTEGER NOT NULL,
+    segment INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    PRIMARY KEY (path, pixel, segment, channel),
+    FOREIGN KEY (path, pixel, segment) REFERENCES segments(path, pixel, segment)
+        ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS segments_by_type ON segments(type, num_points);
+CREATE INDEX IF NOT EXISTS channels_by_name ON channels(channel);
+"""
+
+
+class JPKCatalog:
+    """
+    Catalog of JPK archives, stored in a SQLite database file. For every archive,
+    the catalog holds type, number of points, duration and channels of all
+    segments (of all pixels, for force maps), as read from the header files.
+    Archives are identified by path, size and modification time, so calling
+    :py:meth:`update` again only reads archives that are new or have changed.
+
+    :param db_path: Path to the SQLite database file. It is created if it does not exist.
+    :type db_path: str
+    """
+    def __init__(self, db_path):
+        """Constructor."""
+        #: Connection to the SQLite database.
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        with self.connection:
+            self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        """Closes the connection to the database."""
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def update(self, paths, remove_missing=True):
+        """
+        Adds archives to the catalog, or updates them if they changed since they were added.
+
+        :param paths: Path, or list of paths, to archives or directories. Directories
+         are searched recursively for files with extensions in :py:data:`ARCHIVE_EXTENSIONS`.
+         Glob patterns are expanded.
+        :param remove_missing: If ``True``, archives in the catalog that are located in one
+         of the given directories, but do not exist anymore, are removed from the catalog.
+        :type remove_missing: bool
+        :return: Tuple with three items: number of archives (1) read, (2) unchanged and
+         (3) removed.
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+        num_read = num_unchanged = num_removed = 0
+        directories = []
+        for path in find_archives(paths, directories):
+            stat = os.stat(path)
+            row = self.connection.execute(
+                "SELECT size, mtime FROM archives WHERE path = ?", (path,)).fetchone()
+            if row == (stat.st_size, stat.st_mtime):
+                num_unchanged += 1
+                continue
+            try:
+                rows = read_catalog_rows(path)
+            except Exception as e:
+                warnings.warn("Could not add '%s' to catalog: %s" % (path, e))
+                continue
+            with self.connection:
+                self.connection.execute("DELETE FROM archives WHERE path = ?", (path,))
+                self.connection.execute(
+                    "INSERT INTO archives VALUES (?, ?, ?, ?, ?)",
+                    (path, stat.st_size, stat.st_mtime, rows['kind'], rows['num_pixels']))
+                self.connection.executemany(
+                    "INSERT INTO segments VALUES (?, ?, ?, ?, ?, ?)", rows['segments'])
+                self.connection.executemany(
+                    "INSERT INTO channels VALUES (?, ?, ?, ?)", rows['channels'])
+            num_read += 1
+        if remove_missing:
+            for directory in directories:
+                prefix = os.path.join(directory, '')
+                stale = [p for p, in self.connection.execute(
+                    "SELECT path FROM archives WHERE substr(path, 1, ?) = ?",
+                    (len(prefix), prefix)) if not os.path.exists(p)]
+                with self.connection:
+                    self.connection.executemany("DELETE FROM archives WHERE path = ?",
+                                                [(p,) for p in stale])
+                num_removed += len(stale)
+        return num_read, num_unchanged, num_removed
+
+    def find_segments(self, segment_type=None, min_points=None, max_points=None,
+                      min_duration=None, max_duration=None, channels=None, kind=None):
+        """
+        Returns all segments in the catalog matching the given criteria. Criteria set to
+        ``None`` are ignored. For example, all retract segments with more than 5000 points
+        and a channel 'vDeflection' are found with
+        ``catalog.find_segments('retract', min_points=5001, channels=['vDeflection'])``.
+
+        :param segment_type: Type of segment as returned by ``JPKSegment.get_info('type')``,
+         e.g. 'extend', 'retract' or 'pause'.
+        :type segment_type: str
+        :param min_points: Minimum number of points.
+        :param max_points: Maximum number of points.
+        :param min_duration: Minimum duration.
+        :param max_duration: Maximum duration.
+        :param channels: List of channel names all of which have to be present in the segment.
+        :param kind: Kind of archive: 'force', 'nt-force' or 'force-map'.
+        :return: List of tuples (path, pixel, segment, type, num_points, duration);
+         `pixel` is -1 for archives which are not force maps.
+        """
+        sql = ("SELECT s.path, s.pixel, s.segment, s.type, s.num_points, s.duration "
+               "FROM segments s JOIN archives a ON a.path = s.path WHERE 1")
+        params = []
+        for condition, value in (("s.type = ?", segment_type),
+                                 ("s.num_points >= ?", min_points),
+                                 ("s.num_points <= ?", max_points),
+                                 ("s.duration >= ?", min_duration),
+                                 ("s.duration <= ?", max_duration),
+                                 ("a.kind = ?", kind)):
+            if value is not None:
+                sql += " AND " + condition
+                params.append(value)
+        for channel in channels or []:
+            sql += (" AND EXISTS (SELECT 1 FROM channels c WHERE c.path = s.path"
+                    " AND c.pixel = s.pixel AND c.segment = s.segment AND c.channel = ?)")
+            params.append(channel)
+        sql += " ORDER BY s.path, s.pixel, s.segment"
+        return self.connection.execute(sql, params).fetchall()
+
+    def get_channels(self, path, pixel=-1, segment=0):
+        """Returns list of channels of one segment in the catalog."""
+        return [c for c, in self.connection.execute(
+            "SELECT channel FROM channels WHERE path = ? AND pixel = ? AND segment = ?"
+            " ORDER BY channel", (os.path.abspath(path), pixel, segment))]
+
+    def query(self, sql, parameters=()):
+        """Executes an arbitrary SQL query on the catalog's tables `archives`,
+        `segments` and `channels`, and returns all resulting rows."""
+        return self.connection.execute(sql, parameters).fetchall()
+
+
+def find_archives(paths, directories=None):
+    """
+    Returns sorted list of absolute paths to archives given by `paths`.
+
+    :param paths: List of paths to archives or directories, or glob patterns.
+    :param directories: If a list is given, absolute paths of the
+     directories in `paths` are appended to it.
+    """
+    archives = set()
+    for path in paths:
+        matches = glob.glob(path) if glob.has_magic(path) else [path]
+        for match in matches:
+            if os.path.isdir(match):
+                if directories is not None:
+                    directories.append(os.path.abspath(match))
+                for root, _, files in os.walk(match):
+                    archives.update(os.path.abspath(os.path.join(root, f)) for f in files
+                                    if f.endswith(ARCHIVE_EXTENSIONS))
+            else:
+                archives.add(os.path.abspath(match))
+    return sorted(archives)
+
+
+def read_catalog_rows(path):
+    """Reads headers of archive `path` and returns its rows for the catalog's tables."""
+    rows = {'segments': [], 'channels': []}
+    if path.endswith('.jpk-force-map'):
+        jpk_object = JPKMap(path, lazy=True)
+        rows['kind'] = 'force-map'
+    else:
+        jpk_object = JPKFile(path, lazy=True)
+        rows['kind'] = 'nt-force' if path.endswith('.jpk-nt-force') else 'force'
+    try:
+        if isinstance(jpk_object, JPKMap):
+            rows['num_pixels'] = len(jpk_object.flat_indices)
+            pixels = [(i, jpk_object.flat_indices[i]) for i in sorted(jpk_object.flat_indices)]
+        else:
+            rows['num_pixels'] = 0
+            pixels = [(-1, jpk_object)]
+        for pixel, jpk_file in pixels:
+            for k in sorted(jpk_file.segments):
+                segment = jpk_file.segments[k]
+                rows['segments'].append((path, pixel, k, segment.get_info('type'),
+                                         int(segment.get_info('num-points')),
+                                         float(segment.get_info('duration'))))
+                rows['channels'].extend((path, pixel, k, c) for c in segment.data if c != 't')
+    finally:
+        jpk_object.jpk_zip.close()
+    return rows
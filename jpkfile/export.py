@@ -0,0 +1,278 @@
+"""
+Export of channel data of JPK archives to HDF5 or Parquet files, and the command line
+tool ``jpkfile convert``. Writing HDF5 files requires the package ``h5py``,
+writing Parquet files requires ``pyarrow``.
+"""
+import os
+import sys
+import json
+import argparse
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from .jpkfile import JPKFile, JPKMap, read_pixel, get_channel_dtype
+from .catalog import find_archives
+
+#: File extensions of export formats.
+EXPORT_FORMATS = {'hdf5': '.h5', 'parquet': '.parquet'}
+
+
+def export_archive(jpk_object, fname, file_format=None, channels=None, decode=True,
+                   dtype=None, compression='gzip', chunk_size=2 ** 16):
+    """
+    Writes channel data of all segments (of all pixels, for force maps) to an
+    HDF5 or Parquet file, one segment at a time in chunks of `chunk_size` points
+    (see :py:meth:`JPKSegment.iter_chunks`), together with units and header
+    parameters (serialized as JSON). Channels not read yet are streamed from the
+    archive, so that memory usage does not grow with the length of segments.
+
+    In HDF5 files, each channel is stored in a chunked, compressed dataset
+    ``segments/<segment>/<channel>`` (``pixels/<index>/segments/<segment>/<channel>``
+    for force maps, `index` being the flat pixel index), with the unit as
+    attribute ``unit``. Header parameters are stored in attributes ``parameters``
+    of the file and of each segment's group.
+
+    Parquet files hold one table with columns 'pixel' (-1 for archives which are no
+    force maps), 'segment', and one column per channel; each chunk of a segment is
+    written to a separate row group. Units and parameters are stored in the schema's metadata.
+
+    In both formats, segments lacking any of the channels are skipped with a warning.
+    Pixels of force maps not read yet are read for the export only, and released
+    afterwards.
+
+    :param jpk_object: Archive to export.
+    :type jpk_object: JPKFile or JPKMap
+    :param fname: Path of the file to write.
+    :type fname: str
+    :param file_format: 'hdf5' or 'parquet', see :py:data:`EXPORT_FORMATS`.
+     By default, the format is determined from the extension of `fname`.
+    :type file_format: str
+    :param channels: List of channels to export; by default, all channels of the
+     first segment (Parquet) or of each segment (HDF5).
+    :param decode: Determines whether data is to be decoded.
+    :type decode: bool
+    :param dtype: Data type of exported data, e.g. ``np.float32``, see
+     :py:meth:`JPKSegment.get_array`.
+    :param compression: Compression filter, e.g. 'gzip' or 'lzf' (HDF5), or
+     'snappy' or 'zstd' (Parquet); ``None`` disables compression.
+    :type compression: str
+    :param chunk_size: Number of points per chunk (HDF5) or row group (Parquet).
+    :type chunk_size: int
+    """
+    if file_format is None:
+        file_format = get_export_format(fname)
+    if file_format == 'hdf5':
+        _export_hdf5(jpk_object, fname, channels, decode, dtype, compression, chunk_size)
+    elif file_format == 'parquet':
+        _export_parquet(jpk_object, fname, channels, decode, dtype, compression, chunk_size)
+    else:
+        raise ValueError("Unknown export format '%s', valid formats: %s"
+                         % (file_format, list(EXPORT_FORMATS)))
+
+
+def get_export_format(fname):
+    """Returns the export format (key of :py:data:`EXPORT_FORMATS`) for the extension
+    of `fname`."""
+    extension = os.path.splitext(fname)[1].lower()
+    for file_format, format_extension in EXPORT_FORMATS.items():
+        if extension in (format_extension, '.' + file_format, '.hdf'):
+            return file_format
+    raise ValueError("Can not determine export format from file name '%s'." % fname)
+
+
+def convert_archive(path, fname, **options):
+    """Opens the archive at `path`, exports it to `fname` with :py:func:`export_archive`
+    and closes it again. Returns `fname`."""
+    file_format = options.pop('file_format', None)
+    channels = options.get('channels')
+    if path.endswith('.jpk-force-map'):
+        jpk_object = JPKMap(path, lazy=True, channels=channels)
+    else:
+        jpk_object = JPKFile(path, lazy=True, channels=channels)
+    try:
+        export_archive(jpk_object, fname, file_format, **options)
+    finally:
+        jpk_object.jpk_zip.close()
+    return fname
+
+
+def convert_archives(paths, output_directory, file_format='hdf5', workers=None, **options):
+    """
+    Exports many archives with :py:func:`convert_archive`, using several processes.
+    Output files are named like the archives, with the extension of `file_format`
+    appended, e.g. ``x.jpk-force.h5``. Archives with the same name (in different
+    directories) raise a :py:exc:`ValueError` before anything is written.
+
+    :param paths: Paths to archives or directories, or glob patterns, see
+     :py:func:`~jpkfile.catalog.find_archives`.
+    :param output_directory: Directory to write files to. It is created if it does not exist.
+    :type output_directory: str
+    :param file_format: 'hdf5' or 'parquet'.
+    :type file_format: str
+    :param workers: Number of processes; by default, the number of CPUs.
+     With ``workers=1``, archives are converted in the calling process.
+    :type workers: int
+    :param options: Further keyword arguments to :py:func:`export_archive`.
+    :return: List of paths of written files.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    os.makedirs(output_directory, exist_ok=True)
+    jobs = []
+    targets = {}
+    for path in find_archives(paths):
+        fname = os.path.join(output_directory,
+                             os.path.basename(path) + EXPORT_FORMATS[file_format])
+        if fname in targets:
+            raise ValueError("Archives '%s' and '%s' would both be exported to '%s'."
+                             % (targets[fname], path, fname))
+        targets[fname] = path
+        jobs.append((path, fname))
+    options['file_format'] = file_format
+    if workers == 1:
+        return [convert_archive(path, fname, **options) for path, fname in jobs]
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(convert_archive, path, fname, **options)
+                   for path, fname in jobs]
+        return [f.result() for f in futures]
+
+
+def main(argv=None):
+    """Entry point of the command line tool ``jpkfile``."""
+    parser = argparse.ArgumentParser(prog='jpkfile', description=__doc__.strip().split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    convert = subparsers.add_parser(
+        'convert', help="convert archives to HDF5 or Parquet files",
+        description="Converts channel data of JPK archives to HDF5 or Parquet files.")
+    convert.add_argument('paths', nargs='+',
+                         help="archives, or directories to search for archives")
+    convert.add_argument('-o', '--output', default='.', help="output directory")
+    convert.add_argument('-f', '--format', choices=list(EXPORT_FORMATS), default='hdf5',
+                         help="output format (default: hdf5)")
+    convert.add_argument('-c', '--channels', help="comma separated list of channels")
+    convert.add_argument('--raw', action='store_true', help="export digital data, not decoded")
+    convert.add_argument('--dtype', help="data type, e.g. float32")
+    convert.add_argument('--compression', default='gzip',
+                         help="compression filter, or 'none' (default: gzip)")
+    convert.add_argument('--chunk-size', type=int, default=2 ** 16,
+                         help="points per chunk or row group")
+    convert.add_argument('-j', '--workers', type=int, help="number of processes")
+    args = parser.parse_args(argv)
+
+    written = convert_archives(
+        args.paths, args.output, args.format, args.workers,
+        channels=args.channels.split(',') if args.channels else None,
+        decode=not args.raw,
+        dtype=np.dtype(args.dtype) if args.dtype else None,
+        compression=None if args.compression.lower() == 'none' else args.compression,
+        chunk_size=args.chunk_size)
+    for fname in written:
+        print(fname)
+    return 0
+
+
+def _iter_export_segments(jpk_object):
+    # Yields tuples (flat pixel index, segment index, segment), the pixel index
+    # being -1 for archives which are no force maps. Pixels not read yet are not
+    # kept in the map, so that memory usage does not grow with the number of pixels.
+    if isinstance(jpk_object, JPKMap):
+        for index in sorted(jpk_object.flat_indices):
+            if jpk_object.flat_indices.is_loaded(index):
+                pixel = jpk_object.flat_indices[index]
+            else:
+                pixel = read_pixel(jpk_object, index)
+            for i in sorted(pixel.segments):
+                yield index, i, pixel.segments[i]
+    else:
+        for i in sorted(jpk_object.segments):
+            yield -1, i, jpk_object.segments[i]
+
+
+def _to_json(parameters):
+    return json.dumps(parameters, default=str)
+
+
+def _get_source(jpk_object):
+    return os.path.abspath(jpk_object.jpk_zip.filename)
+
+
+def _export_hdf5(jpk_object, fname, channels, decode, dtype, compression, chunk_size):
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError("Exporting to HDF5 requires the package 'h5py'.")
+    with h5py.File(fname, 'w') as f:
+        f.attrs['source'] = _get_source(jpk_object)
+        f.attrs['parameters'] = _to_json(jpk_object.parameters)
+        if jpk_object.has_shared_header:
+            f.attrs['shared_parameters'] = _to_json(jpk_object.shared_parameters)
+        for pixel, i, segment in _iter_export_segments(jpk_object):
+            name = 'segments/%i' % i if pixel < 0 else 'pixels/%i/segments/%i' % (pixel, i)
+            segment_channels = list(segment.data) if channels is None else channels
+            missing = [c for c in segment_channels if c not in segment.data]
+            if missing:
+                warnings.warn("Skipping segment {} of pixel {}: channels {} not present.".format(
+                    i, pixel, missing))
+                continue
+            group = f.create_group(name)
+            group.attrs['parameters'] = _to_json(segment.parameters)
+            num_points = segment.get_num_points()
+            chunks = (min(num_points, chunk_size),) if num_points else None
+            datasets = {}
+            for c in segment_channels:
+                datasets[c] = group.create_dataset(
+                    c, shape=(num_points,), chunks=chunks, compression=compression,
+                    dtype=dtype if dtype is not None else get_channel_dtype(segment, c, decode))
+            # Datasets are filled chunk by chunk, so that a segment is never in memory
+            # as a whole.
+            units = None
+            for k, arrays, units in segment.iter_chunks(segment_channels, chunk_size, decode,
+                                                        dtype=dtype):
+                for c, data in arrays.items():
+                    datasets[c][k:k + len(data)] = data
+            if units is None:
+                # Segment without points.
+                units = segment.get_array(segment_channels, decode, dtype, 'dict')[1]
+            for c in segment_channels:
+                datasets[c].attrs['unit'] = units[c]
+
+
+def _export_parquet(jpk_object, fname, channels, decode, dtype, compression, chunk_size):
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Exporting to Parquet requires the package 'pyarrow'.")
+    writer = None
+    try:
+        for pixel, i, segment in _iter_export_segments(jpk_object):
+            if channels is None:
+                channels = list(segment.data)
+            missing = [c for c in channels if c not in segment.data]
+            if missing:
+                warnings.warn("Skipping segment {} of pixel {}: channels {} not present.".format(
+                    i, pixel, missing))
+                continue
+            # One row group per chunk, so that a segment is never in memory as a whole.
+            for _, arrays, units in segment.iter_chunks(channels, chunk_size, decode,
+                                                        dtype=dtype):
+                num_points = len(arrays[channels[0]])
+                columns = {'pixel': np.full(num_points, pixel, dtype=np.int32),
+                           'segment': np.full(num_points, i, dtype=np.int32)}
+                columns.update(arrays)
+                if writer is None:
+                    metadata = {'source': _get_source(jpk_object),
+                                'units': json.dumps(units),
+                                'parameters': _to_json(jpk_object.parameters)}
+                    schema = pyarrow.Table.from_pydict(columns).schema.with_metadata(metadata)
+                    writer = pyarrow.parquet.ParquetWriter(fname, schema,
+                                                           compression=compression or 'none')
+                writer.write_table(pyarrow.Table.from_pydict(columns, schema=writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,18 +2,27 @@
 It reads content of data archives created with devices by JPK Instruments."""
 import warnings
 import struct
-from zipfile import ZipFile
+import hashlib
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial, lru_cache
+from zipfile import ZipFile, ZipInfo, ZIP_STORED
 from datetime import datetime
 import numpy as np
+from .cache import archive_fingerprint
+from .stats import LoadStats, measure
+from .pyramid import MinMaxPyramid, PYRAMID_FACTOR
 
-#: Dictionary assigning item length (in .dat files) and struckt.unpack abbreviation
+#: Dictionary assigning item length (in .dat files) and (big-endian) numpy dtype
 #: to the keys used in header files (.properties).
-DATA_TYPES = {'short': (2, 'h'),
-              'short-data': (2, 'h'),
-              'unsignedshort': (2, 'H'),
-              'integer-data': (4, 'i'),
-              'signedinteger': (4, 'i'),
-              'float-data': (4, 'f')}
+DATA_TYPES = {'short': (2, '>i2'),
+              'short-data': (2, '>i2'),
+              'unsignedshort': (2, '>u2'),
+              'integer-data': (4, '>i4'),
+              'signedinteger': (4, '>i4'),
+              'float-data': (4, '>f4')}
 
 # NOT COMPLETE, CURRENTLY NOT USED!
 # Idea: Chain of conversions for different channels to fall back to
@@ -27,13 +36,31 @@ DEFAULT_CONVERSION_CHAIN = {'height': ('nominal',),
                             'error': (),
                             'xSignal1': ()}
 
+#: Layouts of arrays returned by :py:meth:`JPKSegment.get_array` and :py:meth:`JPKFile.get_array`.
+ARRAY_LAYOUTS = ('structured', 'dict', '2d')
+
 #: Dictionary assigning archive type as specified in header files
 #: to file extension suffix (e.g. jpk-force, jpk-nt-force).
 ARCHIVE_TYPES = {"simple-force-scan-series-header": 'force',
                  "nt-force-scan-series-header": 'nt-force'}
 
-#: Set this to `True` in source file to enable debugging output.
-debug = False
+
+_DATE_FORMAT_WITH_ZONE_NAME = '%a %b %d %H:%M:%S %Z %Y'
+#: Formats of the date in the first line of header files, see :py:func:`parse_header_date`.
+HEADER_DATE_FORMATS = ['%Y-%m-%d %H:%M:%S %Z%z', _DATE_FORMAT_WITH_ZONE_NAME]
+
+#: Maximum number of header contents and header shapes remembered, see
+#: :py:func:`parse_header_and_shape`. Set to 0 to disable caching.
+HEADER_CACHE_SIZE = 128
+_split_headers = OrderedDict()
+_header_layouts = OrderedDict()
+# Guards the header caches and HEADER_DATE_FORMATS against concurrent changes.
+_header_cache_lock = threading.Lock()
+
+# Fixed part of a zip archive's local file header: signature, 22 bytes we
+# do not need, length of file name and length of extra field.
+_LOCAL_FILE_HEADER = struct.Struct('<4s22xHH')
+_LOCAL_FILE_HEADER_SIGNATURE = b'PK\x03\x04'
 
 
 def is_segment_header(split):
@@ -41,34 +68,78 @@ def is_segment_header(split):
 
 
 def read_segment_header(self, segment, fname):
-    header_f = self.jpk_zip.open(fname)
-    header_content = header_f.readlines()
-    header_content = decode_binary_strings(header_content)
-    segment.parameters = parse_header_file(header_content)
-    t_end = float(segment
-                  .parameters['force-segment-header']['duration'])
-    t_step = t_end / float(segment
-                           .parameters['force-segment-header']['num-points'])
-    segment.data['t'] = (np.arange(0.0, t_end, t_step), {'unit': 's'})
+    with measure(self, 'header'):
+        with self.jpk_zip.open(fname) as header_f:
+            content = header_f.read()
+        segment.parameters, shape = parse_header_and_shape(content)
+        if self.stats is not None:
+            self.stats.add_bytes('header', len(content))
+    num_points = int(segment.parameters['force-segment-header']['num-points'])
+    t_end = float(segment.parameters['force-segment-header']['duration'])
+    t_step = t_end / num_points if num_points else 0.0
+    segment.data['t'] = (TimeAxis(0.0, t_step, num_points), {'unit': 's'})
     if self.has_shared_header:
-        links = []
-        find_links_in_local_parameters(links,
-                                       segment.parameters,
-                                       self.shared_parameters.keys(), [])
-        replace_links(links, segment.parameters,
-                      self.shared_parameters)
+        with measure(self, 'links'):
+            # Headers with the same keys link to the shared header at the same places,
+            # so the parameter tree only needs to be searched for links once per shape.
+            cached = self.link_cache.get(shape)
+            if cached is None:
+                links = []
+                find_links_in_local_parameters(links,
+                                               segment.parameters,
+                                               self.shared_parameters.keys(), [])
+                cached = self.link_cache[shape] = (links, {})
+            replace_links(cached[0], segment.parameters,
+                          self.shared_parameters, cached[1])
 
         
 def is_segment_data(split):
     return len(split) == 4 and split[3][-4:] == ".dat"
 
 
-def read_segment_data(self, segment_number, segment, split, fname):
-    channel_label = split[3][:-4]
-    data_f = self.jpk_zip.open(fname)
-    content = data_f.read()
-    if debug:
-        print(segment_number, channel_label)
+def read_segment_data(self, segment_number, segment, channel_label, fname):
+    if self.lazy:
+        # Only remember where to find the channel; it is read from the
+        # archive on first access of `segment.data[channel_label]`.
+        try:
+            dtype, parameters = get_channel_info(self, segment, channel_label)
+            segment._sources[channel_label] = (self, fname, dtype, parameters)
+        except KeyError:
+            # Incomplete headers are reported when reading the channel.
+            parameters = None
+        segment.data.set_loader(channel_label,
+                                partial(load_segment_channel, self, segment_number,
+                                        segment, channel_label, fname, parameters))
+    else:
+        segment.data[channel_label] = load_segment_channel(self, segment_number, segment,
+                                                           channel_label, fname)
+
+
+def load_segment_channel(self, segment_number, segment, channel_label, fname,
+                         parameters=None):
+    with measure(self, 'reading'):
+        content = read_member(self, fname)
+        if self.stats is not None:
+            self.stats.add_bytes('reading', len(content))
+    dtype, info = get_channel_info(self, segment, channel_label)
+    if parameters is None:
+        parameters = info
+    if not parameters['encoder_parameters']:
+        warnings.warn("Did not find encoder parameters for channel {}!".format(channel_label))
+    if not parameters['conversion_parameters']:
+        warnings.warn("Did not find conversion parameters for channel {}!".format(channel_label))
+    num_points = int(segment.parameters['force-segment-header']['num-points'])
+
+    with measure(self, 'extraction'):
+        data = extract_data(content, dtype, num_points)
+        if self.stats is not None:
+            self.stats.add_bytes('extraction', data.nbytes)
+    return (data, parameters)
+
+
+def get_channel_info(self, segment, channel_label):
+    # Data type (key of DATA_TYPES) and parameters (encoder and conversion) of
+    # `channel_label`, as read from the header of `segment`.
     # if no shared header was present, this should work
     if not self.has_shared_header:
         dtype = segment.parameters['channel'][channel_label]['data']['type']
@@ -88,25 +159,409 @@ def read_segment_data(self, segment_number, segment, split, fname):
     if 'conversion-set' in segment.parameters['channel'][channel_label]:
         if 'conversion' in segment.parameters['channel'][channel_label]['conversion-set']:
             conversion_parameters = segment.parameters['channel'][channel_label]['conversion-set']
-    if not encoder_parameters:
-        warnings.warn("Did not find encoder parameters for channel {}!".format(split[3][:-4]))
-    if not conversion_parameters:
-        warnings.warn("Did not find conversion parameters for channel {}!".format(split[3][:-4]))
-    num_points = int(segment.parameters['force-segment-header']['num-points'])
+    return dtype, {'encoder_parameters': encoder_parameters,
+                   'conversion_parameters': conversion_parameters}
+
+
+def read_member(self, fname):
+    """Returns content of archive member `fname` (name or ZipInfo). Uncompressed members
+    are returned as read-only view on the memory mapped archive, if
+    :py:attr:`JPKFile.archive_map` is available; all other members are read (and inflated)
+    via the zip file."""
+    if self.archive_map is not None:
+        info = fname if isinstance(fname, ZipInfo) else self.jpk_zip.getinfo(fname)
+        if info.compress_type == ZIP_STORED:
+            return read_stored_member(self.archive_map, info)
+    with self.jpk_zip.open(fname) as data_f:
+        return data_f.read()
+
+
+def open_archive_map(jpk_zip):
+    """
+    Maps the file behind a ZipFile read-only into memory.
+
+    :param jpk_zip: Opened zip archive.
+    :type jpk_zip: ZipFile
+    :return: Numpy memmap (bytes) of the whole archive, or ``None`` if the
+     archive was not opened from a path.
+    """
+    if not isinstance(jpk_zip.filename, str):
+        return None
+    return np.memmap(jpk_zip.filename, dtype=np.uint8, mode='r')
+
+
+def read_stored_member(archive_map, info):
+    """
+    Returns the content of an uncompressed (stored) zip member without copying it.
+    The offset of the content is resolved from the member's local file header,
+    since the length of its extra field may differ from the one in the central directory.
+
+    :param archive_map: Memory mapped archive as returned by :py:func:`open_archive_map`.
+    :param info: ZipInfo of the member to read, compression type has to be ``ZIP_STORED``.
+    :type info: ZipInfo
+    :return: Read-only numpy array (bytes) viewing the member's content.
+    """
+    start = info.header_offset
+    header = archive_map[start:start + _LOCAL_FILE_HEADER.size].tobytes()
+    signature, name_length, extra_length = _LOCAL_FILE_HEADER.unpack(header)
+    if signature != _LOCAL_FILE_HEADER_SIGNATURE:
+        raise RuntimeError("Bad local file header of zip member '%s'." % info.filename)
+    start += _LOCAL_FILE_HEADER.size + name_length + extra_length
+    return archive_map[start:start + info.file_size]
+
+
+class ThreadSafeZipFile(ZipFile):
+    """
+    Read-only ZipFile which keeps a pool of file handles, one per thread, so that
+    members can be read from many threads at the same time. Members opened in the thread
+    which created the instance are read via the instance itself, members opened in other
+    threads via a ZipFile of their own (opened on first use); ZipInfo objects of any of
+    them can be used. Zip inflation releases the GIL, so reading in threads runs in
+    parallel. Archives not opened from a path share the instance's handle.
+    It is used for :py:attr:`JPKFile.jpk_zip` and :py:attr:`JPKMap.jpk_zip`.
+
+    :param fname: Path to the zip archive.
+    :type fname: str
+    """
+    def __init__(self, fname):
+        # Set before opening, since `close` is also called if opening fails.
+        self._owner = threading.get_ident()
+        self._local = threading.local()
+        self._handles = []
+        self._handles_lock = threading.Lock()
+        super().__init__(fname)
+
+    def get_handle(self):
+        """Returns the ZipFile used by the calling thread."""
+        if threading.get_ident() == self._owner or not isinstance(self.filename, str):
+            return self
+        handle = getattr(self._local, 'handle', None)
+        if handle is None or handle.fp is None:
+            handle = self._local.handle = ZipFile(self.filename)
+            with self._handles_lock:
+                self._handles.append(handle)
+        return handle
+
+    def open(self, name, mode='r', pwd=None, **kwargs):
+        if mode != 'r':
+            return super().open(name, mode, pwd, **kwargs)
+        handle = self.get_handle()
+        if handle is self:
+            return super().open(name, mode, pwd, **kwargs)
+        return handle.open(name, mode, pwd, **kwargs)
+
+    def close(self):
+        """Closes the archive and the handles of all threads."""
+        with self._handles_lock:
+            handles, self._handles = self._handles, []
+        for handle in handles:
+            handle.close()
+        super().close()
+
+
+def map_in_threads(threads, func, items):
+    """Returns the list of results of `func` for all `items`, computed in
+    `threads` threads if given, in the calling thread otherwise."""
+    if not threads or len(items) < 2:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(func, items))
+
+
+def is_requested(requested, item):
+    return requested is None or item in requested
+
+
+class _LazyDict(MutableMapping):
+    """
+    Dictionary whose values can be registered as loaders (callables without
+    arguments) that are only called the first time the key is accessed;
+    afterwards, the loaded value is kept. It is used for :py:attr:`JPKSegment.data`
+    of archives opened with ``lazy=True``, and for :py:attr:`JPKMap.flat_indices`.
+    Each loader is called only once, also if the key is accessed from many threads
+    at the same time.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._pending = set()
+        self._locks = {}
+
+    def set_loader(self, key, loader):
+        """Registers `loader` to be called on first access of `key`."""
+        self._entries[key] = loader
+        self._pending.add(key)
+
+    def is_loaded(self, key):
+        """Returns ``True`` if `key` was already read from the archive."""
+        return key in self._entries and key not in self._pending
+
+    def __getitem__(self, key):
+        if key in self._pending:
+            with self._locks.setdefault(key, threading.Lock()):
+                if key in self._pending:
+                    self._entries[key] = self._entries[key]()
+                    self._pending.discard(key)
+            self._locks.pop(key, None)
+        return self._entries[key]
+
+    def __setitem__(self, key, value):
+        self._pending.discard(key)
+        self._entries[key] = value
+
+    def __delitem__(self, key):
+        self._pending.discard(key)
+        del self._entries[key]
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return repr({k: ('<not loaded>' if k in self._pending else v)
+                     for k, v in self._entries.items()})
+
+
+class TimeAxis(np.lib.mixins.NDArrayOperatorsMixin):
+    """
+    Time stamps ``start + i * step`` of the `num_points` points of a segment, stored in
+    :py:attr:`JPKSegment.data` under key 't' instead of an array. Time stamps are
+    computed only when they are needed, e.g. by indexing or slicing, by
+    :py:meth:`materialize`, or by using the axis in numpy functions or arithmetics
+    (which behave as for the materialized array). Other attributes and methods of
+    arrays (e.g. ``copy``, ``astype``, ``mean`` or ``tolist``) are those of the
+    materialized array; :py:attr:`size`, :py:meth:`min` and :py:meth:`max` are
+    computed without it.
+
+    :param start: Time stamp of the first point.
+    :param step: Time between points.
+    :param num_points: Number of points.
+    """
+    dtype = np.dtype(np.float64)
+    ndim = 1
+
+    def __init__(self, start, step, num_points):
+        #: Time stamp of the first point.
+        self.start = start
+        #: Time between points.
+        self.step = step
+        #: Number of points.
+        self.num_points = num_points
+
+    @property
+    def shape(self):
+        return (self.num_points,)
+
+    @property
+    def size(self):
+        """Number of points."""
+        return self.num_points
+
+    def __len__(self):
+        return self.num_points
+
+    def min(self, *args, **kwargs):
+        """Returns the earliest time stamp, see ``numpy.ndarray.min``."""
+        if args or kwargs or not self.num_points:
+            return self.materialize().min(*args, **kwargs)
+        return self[0] if self.step >= 0 else self[-1]
+
+    def max(self, *args, **kwargs):
+        """Returns the latest time stamp, see ``numpy.ndarray.max``."""
+        if args or kwargs or not self.num_points:
+            return self.materialize().max(*args, **kwargs)
+        return self[-1] if self.step >= 0 else self[0]
+
+    def materialize(self, out=None):
+        """Returns all time stamps in an array, or writes them to array `out`.
+        Time stamps are computed in double precision also for other data types of `out`."""
+        if out is None:
+            out = np.empty(self.num_points)
+        if out.dtype != self.dtype:
+            out[...] = (np.arange(self.num_points) * self.step + self.start).reshape(out.shape)
+            return out
+        out[...] = np.arange(self.num_points).reshape(out.shape)
+        out *= self.step
+        out += self.start
+        return out
+
+    def __getattr__(self, name):
+        # Only called for attributes not found otherwise: those of the materialized array.
+        if name.startswith('__') or name in ('start', 'step', 'num_points'):
+            raise AttributeError(name)
+        return getattr(self.materialize(), name)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            indices = range(self.num_points)[key]
+            return np.arange(indices.start, indices.stop, indices.step) * self.step + self.start
+        if isinstance(key, (int, np.integer)):
+            index = range(self.num_points)[key]
+            return self.start + index * self.step
+        return self.materialize()[key]
+
+    def reshape(self, *shape):
+        return self.materialize().reshape(*shape)
+
+    def __array__(self, dtype=None, copy=None):
+        t = self.materialize()
+        return t if dtype is None else t.astype(dtype)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = [x.materialize() if isinstance(x, TimeAxis) else x for x in inputs]
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __repr__(self):
+        return "TimeAxis(start=%r, step=%r, num_points=%r)" % (self.start, self.step,
+                                                               self.num_points)
+
+
+class ArchiveIndex:
+    """
+    Structured index of the members of a JPK archive, built once from the archive's
+    list of files without reading any of them. All readers look members up here instead
+    of searching the list of files. Members are ``ZipInfo`` objects (or names, for
+    indexes built from names). For force maps, each pixel has an index of its own in
+    :py:attr:`pixels`, with names relative to the pixel's folder.
+    Use :py:func:`read_archive_index` to enumerate the content of an archive, e.g.
+    ``for pixel, segment, channel, info in read_archive_index(path).iter_channels()``.
+    """
+    def __init__(self):
+        """Constructor."""
+        #: Top level ``header.properties``, ``None`` if missing.
+        self.header = None
+        #: ``shared-data/header.properties``, ``None`` if missing.
+        self.shared_header = None
+        #: Dictionary assigning dictionaries with keys 'header' (``segment-header.properties``,
+        #: ``None`` if missing) and 'channels' (dictionary assigning data files to channel
+        #: names) to segment indices.
+        self.segments = {}
+        #: Dictionary assigning :py:class:`ArchiveIndex` instances to flat pixel indices
+        #: (force maps only).
+        self.pixels = {}
+        #: Names of members not fitting into the structure of JPK archives.
+        self.unknown = []
+
+    @classmethod
+    def from_zip(cls, jpk_zip):
+        """Returns the index of all members of (opened) zip archive `jpk_zip`."""
+        return cls.from_members((info.filename, info) for info in jpk_zip.infolist())
+
+    @classmethod
+    def from_members(cls, members):
+        """Returns the index of `members`, an iterable of tuples (name, member)."""
+        index = cls()
+        for name, member in members:
+            index.add(name, member)
+        return index
+
+    def add(self, name, member):
+        """Adds `member` to the index at the place given by its `name`."""
+        split = name.split("/")
+        if name == 'header.properties':
+            self.header = member
+        elif name == 'shared-data/header.properties':
+            self.shared_header = member
+        elif split[0] == "index":
+            # Folders of pixels of force maps, 'index/<flat index>/...'.
+            if len(split) < 3:
+                return
+            pixel = self.pixels.get(int(split[1]))
+            if pixel is None:
+                pixel = self.pixels[int(split[1])] = ArchiveIndex()
+            _name = '/'.join(split[2:])
+            if _name:
+                pixel.add(_name, member)
+        elif split[0] == "segments":
+            if len(split) < 3:
+                return
+            segment = self.segments.setdefault(int(split[1]), {'header': None, 'channels': {}})
+            if is_segment_header(split):
+                segment['header'] = member
+            elif is_segment_data(split):
+                segment['channels'][split[3][:-4]] = member
+        else:
+            self.unknown.append(name)
+
+    def iter_channels(self):
+        """Yields tuples (flat pixel index, segment index, channel name, member) for all
+        data files, the pixel index being ``None`` for archives which are no force maps."""
+        for i, segment in self.segments.items():
+            for channel, member in segment['channels'].items():
+                yield None, i, channel, member
+        for index, pixel in self.pixels.items():
+            for _, i, channel, member in pixel.iter_channels():
+                yield index, i, channel, member
+
+    def __repr__(self):
+        return "<ArchiveIndex: %i pixels, %i segments, %i channel files>" % (
+            len(self.pixels), len(self.segments), sum(1 for _ in self.iter_channels()))
+
+
+def read_archive_index(fname):
+    """Returns the :py:class:`ArchiveIndex` of the archive at `fname`; only the archive's
+    list of files is read."""
+    with ZipFile(fname) as jpk_zip:
+        return ArchiveIndex.from_zip(jpk_zip)
 
-    data = extract_data(content, dtype, num_points)
-    segment.data[channel_label] = (data, {'encoder_parameters': encoder_parameters,
-                                          'conversion_parameters': conversion_parameters})
 
-    
 class JPKFile:
     """Class to unzip a JPK archive and handle access to its headers and data.
 
     :param fname: Filename of archive to read data from.
-    :type fname: str"""
-    def __init__(self, fname):        
+    :type fname: str
+    :param lazy: If ``True``, only header files are parsed when opening the archive;
+     data of a channel is read and decoded on first access of
+     ``segment.data[channel]``.
+    :type lazy: bool
+    :param channels: List of channel names to read. Other channels are skipped
+     entirely. ``None`` (default) reads all channels.
+    :param segments: List of segment indices to read. Other segments are skipped
+     entirely. ``None`` (default) reads all segments.
+    :param memory_map: If ``True``, the archive is memory mapped and data of
+     uncompressed channels is returned as read-only view on the mapped file instead
+     of being copied to memory. Compressed channels are read as usual.
+    :type memory_map: bool
+    :param cache: If given, decoded data is stored in and loaded from this cache,
+     see :py:meth:`JPKSegment.get_decoded_data`. Requires `fname` to be a path.
+     Channels are then read lazily (whatever `lazy` is), so that channels found in
+     the cache are never inflated.
+    :type cache: DecodedDataCache
+    :param stats: :py:class:`~jpkfile.LoadStats` instance to record time, bytes and
+     calls per phase of reading in, or ``True`` to create a new one.
+    :type stats: LoadStats
+    :param threads: Number of threads to read and decode segments with in
+     :py:meth:`get_array`. Independent of this, the archive may be accessed from
+     many threads at the same time, see :py:class:`ThreadSafeZipFile`.
+    :type threads: int"""
+    def __init__(self, fname, lazy=False, channels=None, segments=None, memory_map=False,
+                 cache=None, stats=None, threads=None):
         """Initializes JPKFile object."""
-        self.jpk_zip = ZipFile(fname)
+        #: :py:class:`~jpkfile.LoadStats` recording the reading of this archive, or ``None``.
+        self.stats = LoadStats() if stats is True else stats
+        with measure(self, 'listing'):
+            self.jpk_zip = ThreadSafeZipFile(fname)
+            #: :py:class:`ArchiveIndex` of the archive's members.
+            self.archive_index = ArchiveIndex.from_zip(self.jpk_zip)
+        #: :py:class:`~jpkfile.DecodedDataCache` used by all segments, or ``None``.
+        self.cache = cache
+        #: Identifies this archive in :py:attr:`cache`.
+        self.cache_id = (archive_fingerprint(fname),) if cache is not None else None
+        #: Read-only memory map of the archive file if opened with ``memory_map=True``,
+        #: ``None`` otherwise.
+        self.archive_map = open_archive_map(self.jpk_zip) if memory_map else None
+        #: ``True`` if channel data is read on first access only.
+        self.lazy = lazy or cache is not None
+        #: Number of threads used by :py:meth:`get_array`, ``None`` for none.
+        self.threads = threads
+        #: Channels to read, ``None`` for all channels.
+        self.requested_channels = channels
+        #: Segments to read, ``None`` for all segments.
+        self.requested_segments = segments
         self.data = None
         #: Dictionary containing parameters read from the top level 
         #: ``header.properties`` file.
@@ -120,67 +575,84 @@ class JPKFile:
         self.has_shared_header = False
         #: ``None`` if no shared header is present, dictionary containing parameters otherwise.
         self.shared_parameters = None
-
-        # create list of file names in archive (strings, not only file handles).
-        list_of_filenames = [f.filename for f in self.jpk_zip.filelist]
-
-        self.read_files(list_of_filenames)
-
-    def read_files(self, list_of_filenames):
-        """Crawls through list of files in archive and processes them automatically
-        by name and extension. It populates :py:attr:`parameters` and :py:attr:`segments` 
+        #: Dictionary assigning tuples (links to the shared header, i.e. lists of keys,
+        #: and their resolved targets) to shapes of segment headers,
+        #: see :py:func:`parse_header_and_shape`.
+        self.link_cache = {}
+
+        try:
+            self.read_files()
+        except Exception:
+            # Do not leave the archive open if its headers can not be read.
+            self.jpk_zip.close()
+            raise
+
+    def read_files(self, list_of_filenames=None):
+        """Processes the files in :py:attr:`archive_index` automatically by name and
+        extension. It populates :py:attr:`parameters` and :py:attr:`segments`
         with content. For different file types present in JPK archives, 
-        have a look at the :doc:`structure of JPK archives <structure>`."""
-        # top header should also be present and the first file in the filelist.
-        top_header = list_of_filenames.pop(list_of_filenames.index('header.properties'))
-        top_header_f = self.jpk_zip.open(top_header)
-        top_header_content = top_header_f.readlines()
-        top_header_content = decode_binary_strings(top_header_content)
-        
-        # parse content of top header file to self.parameters.
-        self.parameters.update(parse_header_file(top_header_content))
+        have a look at the :doc:`structure of JPK archives <structure>`.
+
+        :param list_of_filenames: If given, :py:attr:`archive_index` is rebuilt from
+         this list of file names first."""
+        if list_of_filenames is not None:
+            self.archive_index = ArchiveIndex.from_members((f, f) for f in list_of_filenames)
+        archive_index = self.archive_index
+        if archive_index.header is None:
+            raise RuntimeError("Archive has no top level header file 'header.properties'.")
+        with measure(self, 'header'):
+            with self.jpk_zip.open(archive_index.header) as top_header_f:
+                # parse content of top header file to self.parameters.
+                self.parameters.update(parse_header_file(top_header_f.read()))
         # if shared header is present ...
-        if list_of_filenames.count("shared-data/header.properties"):
-            parse_shared_header(self, list_of_filenames)
-        # The remaining files should be structured in segments.
-        # The loop is checking for every file in which segment folder it is, and 
-        # whether it's a segment header or data file.
-        # For each new segment folder it encounters, a JPKSegment object is created
-        # and added to the self.segments dictionary.
-        # The JPKSegment is then populated by contents of the segment's
-        # header and data files.
-        segment = None
-        for fname in list_of_filenames:
-            split = fname.split("/")
-            if split[0] == "segments":
-                if len(split) < 3:
-                    continue                
-                segment_number = int(split[1])  # `split[1]` should be the segment's number.                
-                if segment_number > self.num_segments - 1:
-                    new_jpksegment = JPKSegment(self.has_shared_header, self.shared_parameters)
-                    new_jpksegment.index = segment_number
-                    segment = new_jpksegment
-                    self.segments[segment_number] = segment
-                    self.num_segments += 1                        
-                if is_segment_header(split):
-                    read_segment_header(self, segment, fname)
-                # .dat is the extension for data files.
-                elif is_segment_data(split):
-                    read_segment_data(self, segment_number, segment, split, fname)                                                                
-            else:
-                msg = "Encountered new folder '%s'.\n" % split[0]
-                msg += "Do not know how to handle that."
-                warnings.warn(msg)
-
-    def get_array(self, channels=None, decode=True):
+        if archive_index.shared_header is not None:
+            parse_shared_header(self, archive_index.shared_header)
+        for fname in archive_index.unknown:
+            msg = "Encountered new folder '%s'.\n" % fname.split("/")[0]
+            msg += "Do not know how to handle that."
+            warnings.warn(msg)
+        # For each segment folder, a JPKSegment object is created and added to the
+        # self.segments dictionary. The JPKSegment is then populated by contents
+        # of the segment's header and data files.
+        for segment_number, members in archive_index.segments.items():
+            if not is_requested(self.requested_segments, segment_number):
+                continue
+            segment = JPKSegment(self.has_shared_header, self.shared_parameters,
+                                 lazy=self.lazy)
+            segment.index = segment_number
+            segment.stats = self.stats
+            if self.cache is not None:
+                segment.cache = self.cache
+                segment.cache_id = self.cache_id + (segment_number,)
+            self.segments[segment_number] = segment
+            self.num_segments += 1
+            if members['header'] is not None:
+                read_segment_header(self, segment, members['header'])
+            for channel_label, fname in members['channels'].items():
+                if is_requested(self.requested_channels, channel_label):
+                    read_segment_data(self, segment_number, segment, channel_label, fname)
+
+    def get_array(self, channels=None, decode=True, segment_column=False, dtype=None,
+                  layout='structured', out=None):
         """
         Returns channel data from all segments in a numpy array; in addition, reads physical 
         units as specified by header files.
+        The array is allocated once, with the total number of points of all segments as
+        read from header files, and data of each segment is decoded directly into its slice.
 
         :param channels: List of channels (channel names, i.e. strings) of which to return data.
         :param decode: Determines whether data is to be decoded, i.e. transformed according to 
                        transformation parameters defined in header files.
         :type decode: bool
+        :param segment_column: If ``True``, a column 'segment' is added holding
+         the index of the segment each point belongs to (its unit is 'index').
+        :type segment_column: bool
+        :param dtype: Data type of all columns, e.g. ``np.float32``. By default, each
+         column has the data type resulting from decoding, see :py:meth:`JPKSegment.get_array`.
+        :param layout: One of :py:data:`ARRAY_LAYOUTS`, see :py:meth:`JPKSegment.get_array`.
+        :type layout: str
+        :param out: Array (or dictionary of arrays, for `layout` 'dict') of matching shape
+         to write data to, instead of allocating a new one.
         :return: Tuple with two items: (1) Numpy array with labeled columns, one column 
                  per requested channel; (2) dictionary assigning units to channels.
         """
@@ -189,19 +661,11 @@ class JPKFile:
         present_in_all_segments = check_requested_channels_in_all_segments(channels, self)
         
         if present_in_all_segments:
-            # reads data and units of first segment
-            data, units = self.segments[0].get_array(channels, decode)
-            for i in range(1, len(self.segments)):
-                s = self.segments[i]
-                d, u = s.get_array(channels, decode)
-                if u == units:
-                    # concatenates data of segment `i` to array `data`
-                    data = np.concatenate((data, d))
-                else:
-                    msg = "ERROR in JPKFile.get_array!\nCould not concatenate"
-                    msg += "data of all segments: units not matching\n"
-                    raise RuntimeError(msg)
-            return data, units
+            indices = sorted(self.segments)
+            segments = [self.segments[i] for i in indices]
+            lengths = [s.get_num_points() for s in segments]
+            return fill_array(segments, lengths, channels, decode, dtype, layout, out,
+                              indices if segment_column else None, self.threads)
         else:
             msg = "I recommend extracting data of segments separately by using"
             msg += " JPKFile.segments[i].get_array(channels = [...])."
@@ -223,7 +687,7 @@ class JPKFile:
             s = s + "=" * 70 + "\n"
             s = s + "SEGMENT\tTYPE\tNUM POINTS\tDURATION\n"
             s = s + "-------\t----\t----------\t--------\n"            
-            for i in range(len(self.segments)):
+            for i in sorted(self.segments):
                 s = s + str(i) + "\t" + self.segments[i].get_info('type') + "\t" + \
                     self.segments[i].get_info('num-points') \
                     + '\t\t' + self.segments[i].get_info('duration') + '\n'
@@ -234,24 +698,212 @@ class JPKFile:
         return s
 
 
-def parse_shared_header(jpk_object, list_of_filenames):
+def parse_shared_header(jpk_object, shared_header):
     # ... set this to True,
     jpk_object.has_shared_header = True
     jpk_object.shared_parameters = {}
-    # and remove it from list of files.
-    shared_header = list_of_filenames.pop(
-        list_of_filenames.index("shared-data/header.properties")
-    )
-    shared_header_f = jpk_object.jpk_zip.open(shared_header)
-    shared_header_content = shared_header_f.readlines()
-    shared_header_content = decode_binary_strings(shared_header_content)
-    # Parse header content to dictionary.
-    jpk_object.shared_parameters.update(parse_header_file(shared_header_content))
+    with measure(jpk_object, 'header'):
+        with jpk_object.jpk_zip.open(shared_header) as shared_header_f:
+            # Parse header content to dictionary.
+            jpk_object.shared_parameters.update(parse_header_file(shared_header_f.read()))
+
+
+def fill_array(segments, lengths, channels, decode, dtype, layout, out, indices=None,
+               threads=None):
+    # Writes data of `channels` of all `segments` (with `lengths` points each) one
+    # after the other to `out` (allocated if `None`) in `layout`, and returns it
+    # together with the units. If `indices` of segments are given, a column
+    # 'segment' is added. Segments are written in `threads` threads, if given.
+    if layout not in ARRAY_LAYOUTS:
+        raise ValueError("Unknown layout '%s', valid layouts: %s" % (layout, ARRAY_LAYOUTS))
+    total = sum(lengths)
+    first = segments[0]
+    columns = list(channels) + (['segment'] if indices is not None else [])
+    if out is None:
+        dtypes = [dtype if dtype is not None else get_channel_dtype(first, c, decode)
+                  for c in channels]
+        if indices is not None:
+            dtypes.append(np.min_scalar_type(max(indices)))
+        if layout == 'structured':
+            shape = (total,) + get_raw_info(first, channels[0])[0][1:]
+            out = np.empty(shape, dtype=list(zip(columns, dtypes)))
+        elif layout == 'dict':
+            out = {c: np.empty(total, dtype=dt) for c, dt in zip(columns, dtypes)}
+        else:
+            out = np.empty((total, len(columns)),
+                           dtype=dtype if dtype is not None else np.result_type(*dtypes))
+    if layout == '2d':
+        views = {c: out[:, k] for k, c in enumerate(columns)}
+    else:
+        views = {c: out[c] for c in columns}
+    for c in columns:
+        if len(views[c]) != total:
+            msg = "ERROR! Array passed as `out` has %i rows " % len(views[c])
+            msg += "instead of %i for column '%s'." % (total, c)
+            raise RuntimeError(msg)
+
+    stops = np.cumsum(lengths)
+
+    def write_segment(k):
+        start, stop = stops[k] - lengths[k], stops[k]
+        if indices is not None:
+            views['segment'][start:stop] = indices[k]
+        return {c: write_channel_data(segments[k], c, views[c][start:stop], decode)
+                for c in channels}
+
+    all_units = map_in_threads(threads, write_segment, range(len(segments)))
+    units = all_units[0]
+    for u in all_units[1:]:
+        if u != units:
+            msg = "ERROR in JPKFile.get_array!\nCould not concatenate"
+            msg += "data of all segments: units not matching\n"
+            raise RuntimeError(msg)
+    if indices is not None:
+        units['segment'] = 'index'
+    return out, units
+
+
+def get_channel_dtype(self, channel, decode):
+    # dtype of data of `channel` in segment `self` as returned by `JPKSegment.get_array`.
+    if channel == 't':
+        return self.data['t'][0].dtype
+    raw_dtype = get_raw_info(self, channel)[1]
+    return np.result_type(raw_dtype, np.float64) if decode else raw_dtype
+
+
+def check_num_points(self, channel, num_points):
+    if num_points != get_raw_info(self, channel)[0][0]:
+        msg = "ERROR! Number of points in data channel '%s'" % channel
+        msg += "does not match expected number of %i\n" % num_points
+        raise RuntimeError(msg)
+
+
+def write_channel_data(self, channel, out, decode):
+    # Writes data of `channel` in segment `self` to array `out` of the same
+    # number of points, and returns its unit.
+    check_num_points(self, channel, len(out))
+    if channel == 't':
+        time_axis = self.data['t'][0]
+        if isinstance(time_axis, TimeAxis):
+            time_axis.materialize(out)
+        else:
+            out[...] = time_axis.reshape(out.shape)
+        return 's'
+    if not decode:
+        out[...] = self.data[channel][0].reshape(out.shape)
+        return 'digital'
+    return self.get_decoded_data(channel, out=out)[1]
+
+
+def decode_channel(self, channel, conversions_to_be_applied, dtype, out):
+    # Implements `JPKSegment.get_decoded_data` without cache.
+    raw = self.data[channel][0]
+    conversion = self.get_compiled_conversion(channel, conversions_to_be_applied)
+    if out is None:
+        if dtype is None:
+            dtype = np.result_type(raw.dtype, np.float64)
+        out = np.empty(raw.shape, dtype=dtype)
+    else:
+        check_num_points(self, channel, len(out))
+    raw = raw.reshape(out.shape)
+    if conversion is None:
+        out[...] = raw
+        return out, 'digital'
+    multiplier, offset, unit = conversion
+    with measure(self, 'conversion'):
+        np.multiply(raw, multiplier, out=out)
+        out += offset
+        if self.stats is not None:
+            self.stats.add_bytes('conversion', out.nbytes)
+    return out, unit
+
+
+def get_index_range(self, t0, t1, num_points):
+    # Range (start, stop) of indices of points of segment `self` with time stamps
+    # from `t0` to `t1` (inclusive); `None` stands for the first or last point.
+    time_axis = self.data['t'][0]
+    start, stop = 0, num_points
+    if time_axis.step > 0:
+        if t0 is not None:
+            start = int(np.ceil((t0 - time_axis.start) / time_axis.step))
+        if t1 is not None:
+            stop = int(np.floor((t1 - time_axis.start) / time_axis.step)) + 1
+    start = min(max(start, 0), num_points)
+    return start, min(max(stop, start), num_points)
+
+
+def get_conversion_key(channel, conversions_to_be_applied):
+    # Identifies the conversion of `channel` by `conversions_to_be_applied`; for
+    # 'default', the current chain of DEFAULT_CONVERSION_CHAIN is part of the key.
+    if isinstance(conversions_to_be_applied, str):
+        if conversions_to_be_applied == 'default':
+            return (channel, 'default', tuple(DEFAULT_CONVERSION_CHAIN[channel]))
+        return (channel, conversions_to_be_applied)
+    return (channel, tuple(conversions_to_be_applied))
+
+
+def is_channel_loaded(self, channel):
+    return not isinstance(self.data, _LazyDict) or self.data.is_loaded(channel)
+
+
+def get_raw_info(self, channel):
+    # Shape and (native) data type of raw data of `channel` of segment `self`,
+    # without reading the channel's data.
+    source = self._sources.get(channel)
+    if source is not None and not is_channel_loaded(self, channel):
+        return (self.get_num_points(), 1), np.dtype(DATA_TYPES[source[2]][1]).newbyteorder('=')
+    raw = self.data[channel][0]
+    return raw.shape, raw.dtype.newbyteorder('=')
+
+
+def get_channel_parameters(self, channel):
+    # Encoder and conversion parameters of `channel` of segment `self`,
+    # without reading the channel's data.
+    source = self._sources.get(channel)
+    if source is not None and not is_channel_loaded(self, channel):
+        return source[3]
+    return self.data[channel][1]
+
+
+def iter_raw_chunks(self, channel, start, stop, chunk_points):
+    # Yields raw data of `channel` of segment `self` from point `start` to `stop` in
+    # one-dimensional blocks of `chunk_points` points. Channels not read yet are
+    # streamed from the archive (or viewed in its memory map), channels already read
+    # are sliced.
+    source = self._sources.get(channel)
+    if source is None or is_channel_loaded(self, channel):
+        raw = self.data[channel][0]
+        for k in range(start, stop, chunk_points):
+            yield raw[k:min(k + chunk_points, stop)].reshape(-1)
+        return
+    jpk_object, member, dtype, _ = source
+    point_length, type_code = DATA_TYPES[dtype]
+    info = jpk_object.jpk_zip.getinfo(member) if not isinstance(member, ZipInfo) else member
+    num_points = self.get_num_points()
+    if info.file_size // point_length != num_points:
+        msg = "ERROR! Number of data points of channel '%s' is %i," % (
+            channel, info.file_size // point_length)
+        msg += " and does not match the number of present data points %i" % num_points
+        msg += " as read from the segment's header file."
+        raise RuntimeError(msg)
+    if jpk_object.archive_map is not None and info.compress_type == ZIP_STORED:
+        raw = read_stored_member(jpk_object.archive_map, info).view(type_code)
+        for k in range(start, stop, chunk_points):
+            yield raw[k:min(k + chunk_points, stop)]
+        return
+    with jpk_object.jpk_zip.open(member) as data_f:
+        data_f.seek(start * point_length)
+        for k in range(start, stop, chunk_points):
+            with measure(self, 'reading'):
+                content = data_f.read(min(chunk_points, stop - k) * point_length)
+                if self.stats is not None:
+                    self.stats.add_bytes('reading', len(content))
+            yield np.frombuffer(content, dtype=type_code)
 
 
 def check_requested_channels_in_all_segments(channels, self):
     present_in_all_segments = True
-    for i in range(self.num_segments):
+    for i in self.segments:
         for c in channels:
             if c not in self.segments[i].data:
                 present_in_all_segments = False
@@ -271,23 +923,52 @@ class JPKSegment:
     :param shared_properties: If parent_has_shared_header is True, this parameter needs to 
                               hold the dictionary containing the header's contents. Otherwise 
                               it is None.
+    :param lazy: If ``True``, :py:attr:`data` reads channels from the archive
+                 on first access only.
+    :type lazy: bool
     """
-    def __init__(self, parent_has_shared_header=False, shared_properties=None):
+    def __init__(self, parent_has_shared_header=False, shared_properties=None, lazy=False):
         """Constructor."""
         #: Dictionary holding parameters read from segment header.
         self.parameters = {}
-        #: Dictionary assigning numpy arrays containing data and definitions on how 
+        #: Dictionary assigning numpy arrays containing data and definitions on how
         #: to convert raw data to physical data to all channels present in this segment.
-        self.data = {}
+        #: For lazily opened archives, channels are read on first access. Time stamps
+        #: (key 't') are a :py:class:`TimeAxis`, which behaves like a read-only array.
+        self.data = _LazyDict() if lazy else {}
+        #: :py:class:`~jpkfile.DecodedDataCache` used by :py:meth:`get_decoded_data`, or ``None``.
+        self.cache = None
+        #: Identifies this segment in :py:attr:`cache`.
+        self.cache_id = None
+        #: :py:class:`~jpkfile.LoadStats` recording conversions, or ``None``.
+        self.stats = None
+        # Conversions compiled by `get_compiled_conversion`, by channel and
+        # conversions to be applied.
+        self._compiled_conversions = {}
+        # Pyramids built by `get_pyramid`, tuples (raw data, pyramid) by channel.
+        self._pyramids = {}
+        # Channels not read yet, tuples (archive object, member, data type, parameters)
+        # by channel, see `iter_chunks`.
+        self._sources = {}
         self.index = None
         self.parent_has_shared_header = parent_has_shared_header
         self.shared_properties = shared_properties
 
+    def __getstate__(self):
+        # Archive objects of channels not read yet are not sent to other processes.
+        state = self.__dict__.copy()
+        state['_sources'] = {}
+        return state
+
+    def get_num_points(self):
+        """Returns the number of points of the segment as read from its header."""
+        return int(self.parameters['force-segment-header']['num-points'])
+
     def get_time(self, offset=0):
-        """Returns time-stamps, increased by possible offset."""
-        return self.data['t'][0] + offset
+        """Returns time-stamps, increased by possible offset, see :py:class:`TimeAxis`."""
+        return np.asarray(self.data['t'][0]) + offset
 
-    def get_array(self, channels=None, decode=True):
+    def get_array(self, channels=None, decode=True, dtype=None, layout='structured', out=None):
         """
         Constructs a numpy array containing data of given channels. If `decode` is True (default),
         data is converted following conversions defined in segment's header (or shared header).
@@ -296,37 +977,26 @@ class JPKSegment:
         :param decode: Determines whether data is to be decoded, i.e. transformed according 
          to transformation parameters defined in header files.
         :type decode: bool
+        :param dtype: Data type of all columns, e.g. ``np.float32`` to save memory.
+         By default, decoded columns are ``np.float64`` (also for digital data stored
+         as ``float``), or keep the digital data type if `decode` is ``False``.
+        :param layout: One of :py:data:`ARRAY_LAYOUTS`: 'structured' (default) returns a
+         structured array with labeled columns, 'dict' a dictionary of one-dimensional,
+         contiguous arrays, and '2d' a two-dimensional array with one column per channel
+         (in the order of `channels`).
+        :type layout: str
+        :param out: Array (or dictionary of arrays, for `layout` 'dict') as returned
+         for `layout` to write data to, instead of allocating a new one. Buffers can
+         thus be reused for many segments of the same number of points.
         :return: Tuple with two items: (1) Numpy array with labeled columns, one column per 
          requested channel; (2) dictionary assigning units to channels.
         """
         if channels is None:
             channels = []
-        _data = {}
-        dtypes = []
-        shape = self.data[channels[0]][0].shape
-        units = {}
-
-        for c in channels:
-            if c == 't':
-                d = self.data['t'][0]
-                unit = 's'
-            elif decode:
-                d, unit = self.get_decoded_data(c)            
-            else:
-                d, unit = (self.data[c][0], 'digital')
-            if d.shape[0] != shape[0]:
-                msg = "ERROR! Number of points in data channel '%s'" % c
-                msg += "does not match expected number of %i\n" % shape[0]
-                raise RuntimeError(msg)
-            _data[c] = d
-            dtypes.append((c, d.dtype))
-            units[c] = unit
-        arr = np.zeros(shape, dtype=dtypes)
-        for c in channels:
-            arr[c] = _data[c]
-        return arr, units
+        length = get_raw_info(self, channels[0])[0][0]
+        return fill_array([self], [length], channels, decode, dtype, layout, out)
 
-    def get_decoded_data(self, channel, conversions_to_be_applied='auto'):
+    def get_decoded_data(self, channel, conversions_to_be_applied='auto', dtype=None, out=None):
         """
         Get decoded data of one channel. 'decoded' here means the raw, digital data 
         gets converted (to physical data) following certain conversion steps. These steps
@@ -341,26 +1011,211 @@ class JPKSegment:
         :type channel: str
         :param conversions_to_be_applied: Specifying what conversions to apply, 
          see description above.
+        :param dtype: Data type of returned array, ``np.float64`` by default (also
+         for channels without conversion).
+        :param out: Array with as many rows as the channel has points to write converted
+         data to, instead of allocating a new array.
         :return: Tuple with 2 items; 
          (1) Single-column numpy array containing converted data; 
          (2) Unit as read for last conversion step from header file.
+         If the segment has a :py:attr:`cache`, the array may be a read-only memory
+         map of cached data.
         """
-        unit = 'digital'
+        if self.cache is None:
+            return decode_channel(self, channel, conversions_to_be_applied, dtype, out)
+
+        key = self.cache.get_key(self.cache_id,
+                                 *get_conversion_key(channel, conversions_to_be_applied))
+        cached = self.cache.load(key)
+        if cached is None:
+            cached = decode_channel(self, channel, conversions_to_be_applied, None, None)
+            self.cache.store(key, *cached)
+        decoded, unit = cached
+        if out is not None:
+            check_num_points(self, channel, len(out))
+            out[...] = decoded.reshape(out.shape)
+            return out, unit
+        if dtype is not None:
+            return decoded.astype(dtype), unit
+        return decoded, unit
+
+    def iter_chunks(self, channels=None, chunk_points=2 ** 20, decode=True, t0=None, t1=None,
+                    dtype=None):
+        """
+        Yields data of channels in consecutive blocks of at most `chunk_points` points,
+        e.g. to run filters over recordings which do not fit into memory. Channels not
+        read yet (of archives opened with ``lazy=True``) are streamed from the archive
+        block by block, and are not kept in :py:attr:`data`; channels already read
+        are sliced.
+
+        :param channels: List of channels (channel names, i.e. strings); by default,
+         all channels of :py:attr:`data`, including 't'.
+        :param chunk_points: Maximum number of points per block.
+        :type chunk_points: int
+        :param decode: Determines whether data is to be decoded, see :py:meth:`get_array`.
+        :type decode: bool
+        :param t0: Start time (as in :py:meth:`get_time`); by default, the first point.
+        :param t1: End time (inclusive); by default, the last point.
+        :param dtype: Data type of blocks, e.g. ``np.float32``. By default, it is the same
+         as for :py:meth:`get_array`.
+        :return: Generator of tuples with three items: (1) index of the block's first
+         point; (2) dictionary assigning one-dimensional arrays to channels;
+         (3) dictionary assigning units to channels.
+        """
+        if channels is None:
+            channels = list(self.data)
+        start, stop = get_index_range(self, t0, t1, self.get_num_points())
+        conversions = {}
+        units = {}
+        for c in channels:
+            if c == 't':
+                conversions[c], units[c] = None, self.data['t'][1]['unit']
+            elif decode:
+                conversions[c] = self.get_compiled_conversion(c)
+                units[c] = conversions[c][2] if conversions[c] is not None else 'digital'
+            else:
+                conversions[c], units[c] = None, 'digital'
+        dtypes = {c: dtype if dtype is not None else get_channel_dtype(self, c, decode)
+                  for c in channels}
+        readers = {c: iter_raw_chunks(self, c, start, stop, chunk_points) for c in channels}
+        try:
+            for k in range(start, stop, chunk_points):
+                arrays = {}
+                for c, reader in readers.items():
+                    raw = next(reader)
+                    if conversions[c] is None:
+                        arrays[c] = raw.astype(dtypes[c])
+                        continue
+                    multiplier, offset, _ = conversions[c]
+                    out = np.empty(len(raw), dtype=dtypes[c])
+                    np.multiply(raw, multiplier, out=out)
+                    out += offset
+                    arrays[c] = out
+                yield k, arrays, units
+        finally:
+            for reader in readers.values():
+                reader.close()
+
+    def get_pyramid(self, channel):
+        """
+        Returns the :py:class:`~jpkfile.MinMaxPyramid` of raw data of `channel`. It is
+        built on first call and then kept; if the segment has a :py:attr:`cache`, it is
+        stored there as well, so that later sessions do not need to build it again.
+        The channel's data is only read (of lazily opened archives) to build the pyramid,
+        not if it is found in the cache.
+        """
+        channel_parameters = get_channel_parameters(self, channel)
+        kept = self._pyramids.get(channel)
+        if kept is not None and kept[0] is channel_parameters:
+            return kept[1]
+        pyramid = None
+        if self.cache is not None:
+            key = self.cache.get_key(self.cache_id, channel, 'pyramid', PYRAMID_FACTOR)
+            cached = self.cache.load(key)
+            if cached is not None:
+                pyramid = MinMaxPyramid.from_array(cached[0], self.get_num_points())
+        if pyramid is None:
+            pyramid = MinMaxPyramid(self.data[channel][0])
+            if self.cache is not None:
+                self.cache.store(key, pyramid.to_array(), 'digital')
+        self._pyramids[channel] = (channel_parameters, pyramid)
+        return pyramid
+
+    def get_envelope(self, channel, t0=None, t1=None, max_points=2000,
+                     conversions_to_be_applied='auto'):
+        """
+        Returns the envelope of `channel` between times `t0` and `t1`, i.e. minimum and
+        maximum of blocks of points, with at most `max_points` blocks, e.g. to plot
+        long recordings with ``plt.fill_between(t, minimum, maximum)``. Blocks are read
+        from the channel's :py:meth:`get_pyramid`, so only the conversion of the
+        envelope is computed, not of all points. If the range holds at most `max_points`
+        points, each point is a block of its own; only then, or to build the pyramid,
+        the channel's full-resolution data is read.
+
+        :param channel: Name of channel.
+        :type channel: str
+        :param t0: Start time (as in :py:meth:`get_time`); by default, the first point.
+        :param t1: End time (inclusive); by default, the last point.
+        :param max_points: Maximum number of blocks.
+        :type max_points: int
+        :param conversions_to_be_applied: See :py:meth:`get_decoded_data`.
+        :return: Tuple with four items: (1) time of the first point of each block;
+         (2) minima; (3) maxima; (4) unit.
+        """
+        time_axis = self.data['t'][0]
+        start, stop = get_index_range(self, t0, t1, self.get_num_points())
+        pyramid = self.get_pyramid(channel) if stop - start > max_points else None
+        if pyramid is not None and pyramid.levels:
+            indices, minima, maxima = pyramid.get_envelope(start, stop, max_points)
+        else:
+            indices = np.arange(start, stop)
+            minima = maxima = self.data[channel][0][start:stop].ravel()
+        t = indices * time_axis.step + time_axis.start
+        conversion = self.get_compiled_conversion(channel, conversions_to_be_applied)
+        if conversion is None:
+            return t, minima, maxima, 'digital'
+        multiplier, offset, unit = conversion
+        minima, maxima = minima * multiplier + offset, maxima * multiplier + offset
+        if multiplier < 0:
+            minima, maxima = maxima, minima
+        return t, minima, maxima, unit
+
+    def get_compiled_conversion(self, channel, conversions_to_be_applied='auto'):
+        """
+        Same as :py:meth:`get_conversion`, but the result is computed only once per
+        channel and `conversions_to_be_applied`. It is computed again if the channel's
+        parameters are replaced, or, for `conversions_to_be_applied='default'`, if
+        :py:data:`DEFAULT_CONVERSION_CHAIN` is changed.
 
-        encoder_parameters = self.data[channel][1]['encoder_parameters']
-        conversion_parameters = self.data[channel][1]['conversion_parameters']['conversion']
-        data = self.data[channel][0]
+        :return: Tuple (multiplier, offset, unit), or ``None`` if there is no
+         conversion step at all (not even an encoder).
+        """
+        key = get_conversion_key(channel, conversions_to_be_applied)
+        channel_parameters = get_channel_parameters(self, channel)
+        compiled = self._compiled_conversions.get(key)
+        if compiled is None or compiled[0] is not channel_parameters:
+            steps = self.get_conversion_steps(channel, conversions_to_be_applied)
+            conversion = compose_conversion_steps(steps) if steps else None
+            compiled = (channel_parameters, conversion)
+            self._compiled_conversions[key] = compiled
+        return compiled[1]
+
+    def get_conversion(self, channel, conversions_to_be_applied='auto'):
+        """
+        Returns the conversion of raw data of one channel to physical data as a single
+        step, see :py:meth:`get_conversion_steps` and :py:func:`compose_conversion_steps`.
+
+        :return: Tuple (multiplier, offset, unit); physical data is
+         ``raw * multiplier + offset``.
+        """
+        return compose_conversion_steps(self.get_conversion_steps(channel,
+                                                                  conversions_to_be_applied))
+
+    def get_conversion_steps(self, channel, conversions_to_be_applied='auto'):
+        """
+        Reads the steps to convert raw data of one channel to physical data from
+        the channel's encoder and conversion parameters. See
+        :py:meth:`get_decoded_data` for the meaning of `conversions_to_be_applied`.
+
+        :param channel: Name of channel to get conversion steps of.
+        :type channel: str
+        :param conversions_to_be_applied: Specifying what conversions to apply.
+        :return: List of tuples (multiplier, offset, unit), one per step, in the order
+         in which they have to be applied (``raw * multiplier + offset``).
+        """
+        steps = []
+        channel_parameters = get_channel_parameters(self, channel)
+        encoder_parameters = channel_parameters['encoder_parameters']
+        conversion_set = channel_parameters['conversion_parameters']
+        conversion_parameters = conversion_set['conversion'] if conversion_set else None
 
-        raw = data[:]
         # Independet of `conversions_to_be_applied`, the first step of conversion
         # apparently has to be as defined by encoder parameters.
         if encoder_parameters:
             if encoder_parameters['scaling']['style'] == 'offsetmultiplier':
-                multiplier_raw = float(encoder_parameters['scaling']['multiplier'])
-                offset_raw = float(encoder_parameters['scaling']['offset'])
-                raw = multiplier_raw * raw + offset_raw
-
-                unit = encoder_parameters['scaling']['unit']['unit']
+                steps.append((float(encoder_parameters['scaling']['multiplier']),
+                              float(encoder_parameters['scaling']['offset']),
+                              encoder_parameters['scaling']['unit']['unit']))
             else:
                 msg = "ERROR! Can only handle converters of type 'offsetmultiplier' so far."
                 raise RuntimeError(msg)
@@ -392,14 +1247,14 @@ Just send me a mail to ilyasp.ku@gmail.com. THANKS!"""
                     warnings.warn(msg)
             elif conversions_to_be_applied == 'auto':
                 conversions_to_be_applied = determine_conversions_automatically(
-                    self.data[channel][1]['conversion_parameters'])
+                    conversion_set)
             else:
                 msg = "Unknown string '%s' for" % conversions_to_be_applied
                 msg += " function JPKFile.get_decoded_data's parameter conversions_to_be_applied.\n"
                 msg += "Valid strings: 'auto' and 'default'.\nWill now use 'auto'."
                 warnings.warn(msg)
                 conversions_to_be_applied = determine_conversions_automatically(
-                    self.data[channel][1]['conversion_parameters'])
+                    conversion_set)
 
         if conversion_parameters:
 
@@ -416,28 +1271,18 @@ Just send me a mail to ilyasp.ku@gmail.com. THANKS!"""
                         msg += "This conversion was specified as not defined\nin jpk header file." 
                         raise RuntimeError(msg)
 
-            if debug:
-                print("=" * 70)
-                print("APPLYING CONVERSIONS")
             for c in conversions_to_be_applied:
-                if debug:
-                    print(c)
                 if conversion_parameters[c]['scaling']['style'] == 'offsetmultiplier':
-
-                    multiplier = float(conversion_parameters[c]['scaling']['multiplier'])
-                    offset = float(conversion_parameters[c]['scaling']['offset'])
-
-                    raw = raw * multiplier + offset
-
-                    unit = conversion_parameters[c]['scaling']['unit']['unit']
-
+                    steps.append((float(conversion_parameters[c]['scaling']['multiplier']),
+                                  float(conversion_parameters[c]['scaling']['offset']),
+                                  conversion_parameters[c]['scaling']['unit']['unit']))
                 else:
                     msg = "ERROR! Can only handle converters of type 'offsetmultiplier' so far."
                     raise RuntimeError(msg)
         else:
             warnings.warn("No conversion parameters found for channel '{}'.".format(channel))
                         
-        return raw, unit
+        return steps
 
     def get_info(self, issue='general'):
         """
@@ -509,67 +1354,99 @@ class JPKMap:
 
     :param fname: Path to force map (zip archive, usually ending on '.jpk-force-map').
     :type fname: str
+    :param lazy: Passed on to each pixel, see :py:class:`~jpkfile.JPKFile`.
+    :type lazy: bool
+    :param channels: Passed on to each pixel, see :py:class:`~jpkfile.JPKFile`.
+    :param segments: Passed on to each pixel, see :py:class:`~jpkfile.JPKFile`.
+    :param memory_map: See :py:class:`~jpkfile.JPKFile`. All pixels share one map.
+    :type memory_map: bool
+    :param workers: Number of worker processes to read pixels with. If given, all
+     pixels are read in parallel when opening the map, each worker opening the archive
+     itself; `lazy` and `memory_map` then do not apply to the pixels' data.
+     ``None`` (default) reads pixels on first access in the calling process.
+    :type workers: int
+    :param cache: Passed on to each pixel, see :py:class:`~jpkfile.JPKFile`; pixels
+     are then read lazily, except by `workers`.
+    :type cache: DecodedDataCache
+    :param stats: Shared by all pixels, see :py:class:`~jpkfile.JPKFile`. Numbers
+     recorded by `workers` are added to it.
+    :type stats: LoadStats
+    :param pixels: Region of interest: only these pixels are made available in
+     :py:attr:`flat_indices` (and read by `workers`); members of all other pixels
+     are never inflated or parsed. See :py:meth:`get_pixel_indices` for valid regions.
+     ``None`` (default) makes all pixels available.
+    :param threads: Number of threads to read pixels with in :py:meth:`get_pixels` and
+     :py:meth:`get_cube`. Independent of this, pixels may be accessed from many threads
+     at the same time, see :py:class:`ThreadSafeZipFile`.
+    :type threads: int
     """
-    def __init__(self, fname):
+    def __init__(self, fname, lazy=False, channels=None, segments=None, memory_map=False,
+                 workers=None, cache=None, stats=None, pixels=None, threads=None):
         """Constructor"""
-        self.jpk_zip = ZipFile(fname)
+        #: :py:class:`~jpkfile.LoadStats` recording the reading of this map, or ``None``.
+        self.stats = LoadStats() if stats is True else stats
+        with measure(self, 'listing'):
+            self.jpk_zip = ThreadSafeZipFile(fname)
+            #: :py:class:`ArchiveIndex` of the map's members, with one index per pixel.
+            self.archive_index = ArchiveIndex.from_zip(self.jpk_zip)
+        self.cache = cache
+        self.cache_id = (archive_fingerprint(fname),) if cache is not None else None
+        self.archive_map = open_archive_map(self.jpk_zip) if memory_map else None
+        self.lazy = lazy or cache is not None
+        self.requested_channels = channels
+        self.requested_segments = segments
+        self.workers = workers
+        #: Region of interest as passed to the constructor, ``None`` for all pixels.
+        self.region = pixels
+        #: Number of threads used to read pixels, ``None`` for none.
+        self.threads = threads
             
         self.num_indices = 0
         #: Dictionary containing JPKFile instances, one per pixel, indexed with flat indices.
-        self.flat_indices = {}
+        #: Pixels are read from the archive on first access.
+        self.flat_indices = _LazyDict()
         #: Dictionary holding parameters stored in top level header file.
         self.parameters = {}
 
         self.has_shared_header = False
         self.shared_parameters = None
-        
-        self.read_files()
+        # Shared by all pixels, see JPKFile.link_cache.
+        self.link_cache = {}
+
+        try:
+            self.read_files()
+        except Exception:
+            # Do not leave the archive open if its headers can not be read.
+            self.jpk_zip.close()
+            raise
 
     def read_files(self):
-        """Crawls through list of files in archive and processes them automatically
-        by name and extension. It populates :py:attr:`parameters` and :py:attr:`flat_indices` 
+        """Processes the files in :py:attr:`archive_index` automatically by name and
+        extension. It populates :py:attr:`parameters` and :py:attr:`flat_indices`
         with content. For different file types present in JPK archives, 
         have a look at the :doc:`structure of JPK archives <structure>`."""
-        list_of_filenames = [f.filename for f in self.jpk_zip.filelist]
-
-        top_header_f = self.jpk_zip.open(list_of_filenames.pop(
-            list_of_filenames.index('header.properties')))
-        top_header_content = top_header_f.readlines()
-        top_header_content = decode_binary_strings(top_header_content)
-
-        # parse content of top header file to self.parameters.
-        self.parameters.update(parse_header_file(top_header_content))
-
-        if list_of_filenames.count("shared-data/header.properties"):
-            parse_shared_header(self, list_of_filenames)
-
-        index_lists_of_filenames = {}
-
-        for fname in list_of_filenames:
-            
-            split = fname.split("/")
-
-            if split[0] == "index":
-                if len(split) < 3:
-                    pass
-                else:
-                    index = int(split[1])
-
-                    if index > self.num_indices - 1:
-                        
-                        index_lists_of_filenames[index] = []
-                        self.num_indices += 1
-                        
-                    _fname = '/'.join(split[2:])
-                    if _fname:
-                        index_lists_of_filenames[index].append(_fname)
-
-        for i in index_lists_of_filenames.keys():
-            virtual_zip = _VirtualZipFile(
-                self.jpk_zip, index_lists_of_filenames[i], "index/" + str(i) + "/")
-            new_jpkfile = _JPKFileForJPKMap(
-                virtual_zip, self.has_shared_header, self.shared_parameters)
-            self.flat_indices[i] = new_jpkfile
+        archive_index = self.archive_index
+        if archive_index.header is None:
+            raise RuntimeError("Archive has no top level header file 'header.properties'.")
+        with measure(self, 'header'):
+            with self.jpk_zip.open(archive_index.header) as top_header_f:
+                # parse content of top header file to self.parameters.
+                self.parameters.update(parse_header_file(top_header_f.read()))
+
+        if archive_index.shared_header is not None:
+            parse_shared_header(self, archive_index.shared_header)
+
+        self.num_indices = len(archive_index.pixels)
+        indices = list(archive_index.pixels)
+        if self.region is not None:
+            requested = set(self.get_pixel_indices(self.region))
+            indices = [i for i in indices if i in requested]
+        if self.workers:
+            read_pixels_in_parallel(self, indices)
+            return
+        # Pixels are only created (i.e. their headers and data read) when accessed.
+        for i in indices:
+            self.flat_indices.set_loader(i, partial(read_pixel, self, i))
                     
     def get_single_pixel(self, index):
         """
@@ -585,7 +1462,7 @@ class JPKMap:
                 i = int(self.parameters['force-scan-map']['position-pattern']['grid']['ilength'])
                 j = int(self.parameters['force-scan-map']['position-pattern']['grid']['jlength'])
                 if i > index[0] and j > index[1]:
-                    return self.flat_indices[i * index[0] + index[1]]
+                    return self.flat_indices[self.get_flat_index(index[0], index[1])]
                 else:
                     msg = "Index is [%i,%i], but max range is limited to [%i,%i].\n" % (index[0],
                                                                                         index[1],
@@ -605,7 +1482,311 @@ class JPKMap:
                 else:
                     warnings.warn("Returning None")
                     return
-            
+
+    def get_pixels(self, region):
+        """
+        Returns the pixels in a region of interest. Only members of these pixels are
+        read from the archive. Pixels missing in the archive or outside of the region
+        passed to the constructor are left out.
+
+        Pixels are read in :py:attr:`threads` threads, if given.
+
+        :param region: See :py:meth:`get_pixel_indices`.
+        :return: Dictionary assigning JPKFile instances to flat indices.
+        """
+        indices = [i for i in self.get_pixel_indices(region) if i in self.flat_indices]
+        return dict(zip(indices, map_in_threads(self.threads, self.flat_indices.__getitem__,
+                                                indices)))
+
+    def get_pixel_indices(self, region):
+        """
+        Returns the sorted flat indices of pixels in a region of interest, which is one of
+
+         * a tuple (rows, columns) of grid coordinates, each an integer or a slice,
+           e.g. ``(slice(100, 110), slice(20, 30))``,
+         * a boolean mask of the grid's shape (see :py:meth:`get_grid_shape`),
+         * a list of flat indices or of tuples (i, j) of grid coordinates.
+
+        Integers (and bounds of slices) may be negative to count from the end, as
+        for sequences; coordinates or indices outside of the grid raise an ``IndexError``.
+
+        :param region: Region of interest.
+        :return: List of flat indices.
+        """
+        ilength, jlength = self.get_grid_shape()
+        if isinstance(region, tuple):
+            rows, columns = region
+            rows = get_grid_range(rows, ilength, 'row')
+            columns = get_grid_range(columns, jlength, 'column')
+            return sorted(set(self.get_flat_index(i, j) for i in rows for j in columns))
+        region = np.asarray(region)
+        if region.dtype == bool:
+            if region.shape != self.get_grid_shape():
+                msg = "Mask has shape %s, but the map's grid has shape %s." % (
+                    region.shape, self.get_grid_shape())
+                raise RuntimeError(msg)
+            return sorted(set(self.get_flat_index(int(i), int(j))
+                              for i, j in zip(*np.nonzero(region))))
+        if region.ndim == 2:
+            return sorted(set(self.get_flat_index(get_grid_range(int(i), ilength, 'row')[0],
+                                                  get_grid_range(int(j), jlength, 'column')[0])
+                              for i, j in region))
+        return sorted(set(get_grid_range(int(i), ilength * jlength, 'flat index')[0]
+                          for i in region))
+
+    def get_grid_shape(self):
+        """Returns tuple (ilength, jlength) of the map's grid, as read from the top level header."""
+        grid = self.parameters['force-scan-map']['position-pattern']['grid']
+        return int(grid['ilength']), int(grid['jlength'])
+
+    def get_flat_index(self, i, j):
+        """Returns the flat index of the pixel at grid coordinates (`i`, `j`), i.e. pixels
+        are numbered row by row, each row `i` holding ``jlength`` pixels."""
+        return self.get_grid_shape()[1] * i + j
+
+    def get_cube(self, channel, segment, decode=True, conversions_to_be_applied='auto'):
+        """
+        Returns data of one channel in one segment for all pixels of the map in a single
+        array of shape (ilength, jlength, num_points), where the pixel at
+        ``[i, j]`` is the one returned by ``get_single_pixel((i, j))``.
+        Pixels not yet read are not created; only the required segment header and
+        channel are read for them, in :py:attr:`threads` threads if given. If `decode`
+        is True (default), the conversion of all pixels is applied in a single pass.
+        If pixels differ in their number of points, ``num_points`` is the maximum;
+        decoded data is padded with NaN, raw data with zeros. Pixels outside of the region
+        of interest (see :py:attr:`region`) are treated as missing. Channels and segments
+        excluded by `channels` and `segments` of the constructor raise a ``ValueError``.
+
+        :param channel: Name of channel to return data of.
+        :type channel: str
+        :param segment: Index of segment to return data of.
+        :type segment: int
+        :param decode: Determines whether data is to be decoded, i.e. transformed according
+         to transformation parameters defined in header files.
+        :type decode: bool
+        :param conversions_to_be_applied: Conversions applied if `decode` is True,
+         see :py:meth:`JPKSegment.get_decoded_data`.
+        :return: Tuple with three items: (1) Numpy array with data of all pixels;
+         (2) unit of data; (3) integer array of shape (ilength, jlength) holding the
+         number of valid points per pixel (0 for pixels missing in the archive).
+        """
+        check_cube_request(self, channel, segment)
+        ilength, jlength = self.get_grid_shape()
+        pixels = get_grid_pixels(self)
+        raw = {}
+        conversions = {}
+
+        def read_pixel_channel(ij):
+            s = get_cube_segment(self, self.get_flat_index(*ij), channel, segment)
+            return (s.data[channel][0][:, 0],
+                    s.get_conversion(channel, conversions_to_be_applied) if decode else None)
+
+        for ij, (d, conversion) in zip(pixels, map_in_threads(self.threads, read_pixel_channel,
+                                                              pixels)):
+            raw[ij] = d
+            if decode:
+                conversions[ij] = conversion
+
+        lengths = np.zeros((ilength, jlength), dtype=int)
+        for ij, d in raw.items():
+            lengths[ij] = d.shape[0]
+        if decode:
+            multipliers, offsets, unit = stack_conversions(self, channel, conversions)
+            cube = np.full((ilength, jlength, lengths.max()), np.nan)
+        else:
+            unit = 'digital'
+            dtype = np.result_type(*raw.values()) if raw else np.dtype(float)
+            cube = np.zeros((ilength, jlength, lengths.max()), dtype=dtype.newbyteorder('='))
+        for ij, d in raw.items():
+            cube[ij][:d.shape[0]] = d
+        if decode:
+            with measure(self, 'conversion'):
+                cube *= multipliers
+                cube += offsets
+                if self.stats is not None:
+                    self.stats.add_bytes('conversion', cube.nbytes)
+        return cube, unit, lengths
+
+    def get_conversion_cubes(self, channel, segment, conversion_sets=('auto',)):
+        """
+        Returns conversions of one channel in one segment for all pixels of the map
+        (see :py:meth:`JPKSegment.get_conversion`), reading headers only, and each
+        header only once for all `conversion_sets`. Together with
+        ``get_cube(channel, segment, decode=False)``, data of a channel can thus be read
+        once and converted in several ways, as ``cube * multipliers + offsets``.
+
+        :param channel: Name of channel.
+        :type channel: str
+        :param segment: Index of segment.
+        :type segment: int
+        :param conversion_sets: List of values of `conversions_to_be_applied`, see
+         :py:meth:`JPKSegment.get_decoded_data`.
+        :return: List of tuples, one per item of `conversion_sets`, with three items:
+         (1) multipliers and (2) offsets, arrays of shape (ilength, jlength, 1), NaN for
+         pixels missing in the archive; (3) unit of converted data.
+        """
+        check_cube_request(self, channel, segment)
+        pixels = get_grid_pixels(self)
+
+        def read_pixel_conversions(ij):
+            s = get_cube_segment(self, self.get_flat_index(*ij), channel, segment)
+            return [s.get_conversion(channel, c) for c in conversion_sets]
+
+        conversions = map_in_threads(self.threads, read_pixel_conversions, pixels)
+        return [stack_conversions(self, channel, {ij: c[k] for ij, c in zip(pixels, conversions)})
+                for k in range(len(conversion_sets))]
+
+
+def get_grid_range(index, length, name):
+    # Range of coordinates selected by integer or slice `index` along an axis of
+    # `length` pixels (`name` for messages); raises IndexError for values outside.
+    msg = "%s %s is out of range for %i pixels."
+    if isinstance(index, slice):
+        for value in (index.start, index.stop):
+            if value is not None and not -length <= value <= length:
+                raise IndexError(msg % (name.capitalize(), value, length))
+        return range(length)[index]
+    if not -length <= index < length:
+        raise IndexError(msg % (name.capitalize(), index, length))
+    return [range(length)[index]]
+
+
+def check_cube_request(self, channel, segment):
+    # Raises ValueError if `channel` or `segment` are excluded by the filters
+    # map `self` was opened with.
+    if self.requested_channels is not None and channel not in self.requested_channels:
+        raise ValueError("Channel '%s' is not among the channels %s the map was opened with."
+                         % (channel, self.requested_channels))
+    if self.requested_segments is not None and segment not in self.requested_segments:
+        raise ValueError("Segment %s is not among the segments %s the map was opened with."
+                         % (segment, self.requested_segments))
+
+
+def get_grid_pixels(self):
+    # Grid coordinates of all pixels of map `self` which are present (and in the
+    # region of interest); pixels not on the grid are left out with a warning.
+    ilength, jlength = self.get_grid_shape()
+    pixels = [(i, j) for i in range(ilength) for j in range(jlength)
+              if self.get_flat_index(i, j) in self.flat_indices]
+    if len(pixels) != len(self.flat_indices):
+        outside = sorted(set(self.flat_indices) - set(self.get_flat_index(i, j)
+                                                     for i, j in pixels))
+        msg = "Pixels %s are not on the map's grid of shape %s and are left out." % (
+            outside, (ilength, jlength))
+        warnings.warn(msg)
+    return pixels
+
+
+def get_cube_segment(self, index, channel, segment):
+    # Segment `segment` of pixel `index` of map `self`. For pixels not read yet, a
+    # pixel reading only `channel` of `segment` is created, and not kept.
+    if self.flat_indices.is_loaded(index):
+        pixel = self.flat_indices[index]
+    else:
+        pixel = _JPKFileForJPKMap(
+            get_pixel_zip(self, index),
+            self.has_shared_header, self.shared_parameters,
+            lazy=True, channels=[channel], segments=[segment],
+            archive_map=self.archive_map, link_cache=self.link_cache,
+            cache=self.cache, cache_id=get_pixel_cache_id(self, index),
+            stats=self.stats)
+    return pixel.segments[segment]
+
+
+def stack_conversions(self, channel, conversions):
+    # Multipliers and offsets of shape (ilength, jlength, 1) of map `self`, NaN for
+    # pixels missing in `conversions`, and the common unit, from tuples
+    # (multiplier, offset, unit) assigned to grid coordinates.
+    units = set(unit for _, _, unit in conversions.values())
+    if len(units) > 1:
+        msg = "ERROR in JPKMap!\nUnits of channel '%s'" % channel
+        msg += " do not match for all pixels: %s\n" % ', '.join(sorted(units))
+        raise RuntimeError(msg)
+    ilength, jlength = self.get_grid_shape()
+    multipliers = np.full((ilength, jlength, 1), np.nan)
+    offsets = np.full((ilength, jlength, 1), np.nan)
+    for ij, (multiplier, offset, _) in conversions.items():
+        multipliers[ij] = multiplier
+        offsets[ij] = offset
+    return multipliers, offsets, units.pop() if units else 'digital'
+
+
+def read_pixel(self, index):
+    return _JPKFileForJPKMap(
+        get_pixel_zip(self, index), self.has_shared_header, self.shared_parameters,
+        self.lazy, self.requested_channels, self.requested_segments,
+        self.archive_map, self.link_cache, self.cache, get_pixel_cache_id(self, index),
+        self.stats)
+
+
+def get_pixel_zip(self, index):
+    return _VirtualZipFile(self.jpk_zip, self.archive_index.pixels[index],
+                           "index/" + str(index) + "/")
+
+
+def get_pixel_cache_id(self, index):
+    return self.cache_id + (index,) if self.cache is not None else None
+
+
+def read_pixels_in_parallel(self, indices):
+    indices = sorted(indices)
+    if not indices:
+        return
+    # A few ranges per worker, so that workers finishing early can pick up more.
+    n_ranges = min(len(indices), 4 * self.workers)
+    ranges = [indices[k::n_ranges] for k in range(n_ranges)]
+    with ProcessPoolExecutor(max_workers=self.workers) as executor:
+        futures = [executor.submit(read_pixel_range, self.jpk_zip.filename, r,
+                                   self.requested_channels, self.requested_segments,
+                                   self.cache, self.stats)
+                   for r in ranges]
+        for future in futures:
+            pixels, stats = future.result()
+            if stats is not None:
+                self.stats.merge(stats)
+            for i, pixel in pixels.items():
+                # Reattach what was detached for transfer between processes.
+                pixel.jpk_zip = get_pixel_zip(self, i)
+                pixel.archive_index = pixel.jpk_zip.archive_index
+                pixel.shared_parameters = self.shared_parameters
+                pixel.stats = self.stats
+                for segment in pixel.segments.values():
+                    segment.shared_properties = self.shared_parameters
+                    segment.stats = self.stats
+                self.flat_indices[i] = pixel
+
+
+def read_pixel_range(fname, indices, channels, segments, cache=None, stats=None):
+    """
+    Reads pixels with given flat `indices` from force map `fname`. This is
+    executed in worker processes, see `workers` parameter of :py:class:`~jpkfile.JPKMap`.
+    Handles to the archive and the shared parameters are removed from the returned
+    pixels, since they can not (or should not) be sent back to the parent process.
+
+    :param stats: If given, numbers are recorded in a new :py:class:`~jpkfile.LoadStats`
+     instance with the same settings.
+    :return: Tuple with two items: (1) dictionary assigning pixels (without archive handle)
+     to flat indices; (2) :py:class:`~jpkfile.LoadStats` of the worker, or ``None``.
+    """
+    if stats is not None:
+        stats = LoadStats(trace_memory=stats.trace_memory)
+    jpk_map = JPKMap(fname, channels=channels, segments=segments, cache=cache, stats=stats)
+    # Pixels are sent back to the parent process, so their data has to be read here.
+    jpk_map.lazy = False
+    pixels = {}
+    for i in indices:
+        pixel = jpk_map.flat_indices[i]
+        pixel.jpk_zip = None
+        pixel.archive_index = None
+        pixel.shared_parameters = None
+        pixel.stats = None
+        for segment in pixel.segments.values():
+            segment.shared_properties = None
+            segment.stats = None
+        pixels[i] = pixel
+    jpk_map.jpk_zip.close()
+    return pixels, stats
+
 
 class _VirtualZipFile:
     """
@@ -619,26 +1800,25 @@ class _VirtualZipFile:
     :param parent_zip: ZipFile instance holding the subfolder that is to 
                        be governed by this _VirtualZipFile.
     :type parent_zip: ZipFile
-    :param excerpt_list_of_filenames: List of filenames (strings) containing 
-                                      only files of the subfolder; path has to be relative 
-                                      as if looking from within the subfolder.
+    :param archive_index: :py:class:`ArchiveIndex` of the subfolder, with paths relative
+                          to the subfolder.
     :param prefix: Path prefix, i.e., path to the subfoler. This is used 
                    to construct the complete path to each file for the real ZipFile instance.
     :type prefix: str
     """
-    def __init__(self, parent_zip, excerpt_list_of_filenames, prefix):
+    def __init__(self, parent_zip, archive_index, prefix):
         
         #: (Pointer to) Real ZipFile instance, containing this _VirtualZipFile's folder.
         self.parent_zip = parent_zip
 
-        #: List of filenames (strings) containing only files of the subfolder; 
-        #: Paths have to be relative as if looking from within the subfolder.
+        #: :py:class:`ArchiveIndex` of the subfolder. Its members are ZipInfo objects
+        #: of `parent_zip`, indexed by paths relative to the subfolder.
         #: For example, if your complete zip archive (see files in `parent_zip`)
         #: has a folder called 'A', and it contains a file named 'bla.txt',
         #: its path will be 'A/bla.txt' in the real ZipFile. In a
         #: `_VirtualZipFile` supposed to govern the contents of folder 'A',
         #: the path has to be only 'bla.txt', however.
-        self.list_of_filenames = excerpt_list_of_filenames
+        self.archive_index = archive_index
 
         #: Prefix to the folder governed by this _VirtualZipFile.
         #: Referring to the example above, this needs to be 'A/'.
@@ -646,8 +1826,15 @@ class _VirtualZipFile:
         self.prefix = prefix
 
     def open(self, fname):
+        if isinstance(fname, ZipInfo):
+            return self.parent_zip.open(fname)
         return self.parent_zip.open(self.prefix + fname)
 
+    def getinfo(self, fname):
+        if isinstance(fname, ZipInfo):
+            return fname
+        return self.parent_zip.getinfo(self.prefix + fname)
+
     
 class _JPKFileForJPKMap(JPKFile):
     """
@@ -660,10 +1847,29 @@ class _JPKFileForJPKMap(JPKFile):
     :param virtual_zip: (Pointer to) _VirtualZipFile for the subdirectory.
     :param has_shared_header: `True` if parent `JPKMap` has a shared header, `False` otherwise.
     :param shared_parameters: `None` if no shared header present, 
-     a dictionary containing parameters read from shared header otherwise."""
-    def __init__(self, virtual_zip, has_shared_header, shared_parameters):
+     a dictionary containing parameters read from shared header otherwise.
+    :param lazy: See :py:class:`~jpkfile.JPKFile`.
+    :param channels: See :py:class:`~jpkfile.JPKFile`.
+    :param segments: See :py:class:`~jpkfile.JPKFile`.
+    :param archive_map: Memory map of the parent archive, or ``None``.
+    :param link_cache: Cache of links to the shared header of the parent `JPKMap`,
+     see :py:attr:`JPKFile.link_cache`.
+    :param cache: See :py:class:`~jpkfile.JPKFile`.
+    :param cache_id: Identifies the pixel in `cache`.
+    :param stats: :py:class:`~jpkfile.LoadStats` of the parent `JPKMap`, or ``None``."""
+    def __init__(self, virtual_zip, has_shared_header, shared_parameters,
+                 lazy=False, channels=None, segments=None, archive_map=None, link_cache=None,
+                 cache=None, cache_id=None, stats=None):
 
         self.jpk_zip = virtual_zip
+        self.stats = stats
+        self.cache = cache
+        self.cache_id = cache_id
+        self.archive_map = archive_map
+        self.lazy = lazy
+        self.threads = None
+        self.requested_channels = channels
+        self.requested_segments = segments
         self.data = None
         #: Dictionary containing parameters read from the top level 
         #: ``header.properties`` file.
@@ -677,14 +1883,31 @@ class _JPKFileForJPKMap(JPKFile):
         self.has_shared_header = has_shared_header
         #: ``None`` if no shared header is present, dictionary containing parameters otherwise.
         self.shared_parameters = shared_parameters
+        self.link_cache = {} if link_cache is None else link_cache
 
-        list_of_filenames = self.jpk_zip.list_of_filenames
+        self.archive_index = self.jpk_zip.archive_index
 
-        self.read_files(list_of_filenames)
+        self.read_files()
         
         self.index = None
 
         
+def compose_conversion_steps(steps):
+    """
+    Combines a chain of conversion steps, each of the form ``raw * multiplier + offset``,
+    into a single step.
+
+    :param steps: List of tuples (multiplier, offset, unit) as returned by
+     :py:meth:`JPKSegment.get_conversion_steps`.
+    :return: Tuple (multiplier, offset, unit) of combined conversion, the unit being
+     that of the last step ('digital' for empty chains).
+    """
+    multiplier, offset, unit = 1.0, 0.0, 'digital'
+    for m, o, unit in steps:
+        multiplier, offset = multiplier * m, offset * m + o
+    return multiplier, offset, unit
+
+
 def determine_conversions_automatically(conversion_set_dictionary):
     """
     Takes all parameters on how to convert some channel's data read from a header file 
@@ -740,7 +1963,9 @@ def extract_data(content, dtype, num_points):
     :type dtype: str
     :param num_points: Expected number of points encoded in binary content.
     :type num_points: int
-    :return: Numpy array containing digital (non-physical, unconverted) data."""
+    :return: Numpy array containing digital (non-physical, unconverted) data.
+     The array is a read-only view on `content`, keeping the (big-endian) data
+     type of the samples as stored in the archive."""
     point_length, type_code = DATA_TYPES[dtype]
 
     n_entries = len(content) // point_length
@@ -750,44 +1975,150 @@ def extract_data(content, dtype, num_points):
         msg += " as read from the segment's header file."
         raise RuntimeError(msg)
 
-    data = np.array(struct.unpack_from(f'!{num_points}{type_code}', content))
+    data = np.frombuffer(content, dtype=type_code, count=num_points)
     data = data[:, np.newaxis]
 
     return data
 
 
 def parse_header_file(content):
-    header_dict = {}
-    start = 0
-
-    if str(content[start][:2]) == "##":
-        start = 1
-
-    datestr = content[start][1:].strip()
-    try:
-        fmt = '%Y-%m-%d %H:%M:%S %Z%z'
-        t = datetime.strptime(datestr, fmt)
-    except:
-        fmt = "%a %b %d %H:%M:%S %Z %Y"
-        t = datetime.strptime(datestr, fmt)
-
-    header_dict['date'] = t
-
-    for line in content[start + 1:]:
-        key, value = str(line).split('=')
-        value = value.strip()
-        split_key = key.split(".")
-        d = header_dict
-        if len(split_key) > 1:
-            for s in split_key[:-1]:
-                if s in d:
-                    d = d[s]
-                else:
-                    d[s] = {}
-                    d = d[s]
-        d[split_key[-1]] = value
-    
-    return header_dict
+    """
+    Parses the content of a header file (.properties) to a nested dictionary.
+    Keys are split at dots, so that e.g. the line ``channel.height.type=short``
+    results in ``header_dict['channel']['height']['type'] == 'short'``. The date in
+    the first comment line is stored as :py:class:`datetime.datetime` under ``'date'``.
+
+    :param content: Binary content of a header file, or list of its (decoded) lines.
+    :return: Dictionary containing parameters.
+    """
+    return parse_header_and_shape(content)[0]
+
+
+def parse_header_and_shape(content):
+    """
+    Same as :py:func:`parse_header_file`, but also returns the header's shape,
+    i.e. the keys of all parameters in order of appearance. Headers with the same
+    shape result in dictionaries with the same structure, which is only worked out
+    once per shape. In addition, the lines of binary `content` are only split once
+    per content (identified by a hash). See :py:data:`HEADER_CACHE_SIZE`.
+
+    :param content: Binary content of a header file, or list of its (decoded) lines.
+    :return: Tuple with two items: (1) dictionary containing parameters;
+     (2) tuple of keys (strings).
+    """
+    if isinstance(content, (bytes, bytearray)):
+        digest = hashlib.blake2b(content, digest_size=16).digest()
+        split = _get_cached(_split_headers, digest)
+        if split is None:
+            split = _split_header_lines(content.decode('utf-8').splitlines())
+            _set_cached(_split_headers, digest, split)
+    else:
+        split = _split_header_lines(content)
+    date, shape, values = split
+
+    layout = _get_cached(_header_layouts, shape)
+    if layout is None:
+        layout = _get_header_layout(shape)
+        _set_cached(_header_layouts, shape, layout)
+    num_nodes, assignments = layout
+
+    nodes = [{} for _ in range(num_nodes)]
+    if date is not None:
+        nodes[0]['date'] = date
+    # Values and dictionaries are addressed by the same index in `assignments`.
+    objects = values + nodes
+    for node, key, item in assignments:
+        nodes[node][key] = objects[item]
+    return nodes[0], shape
+
+
+def _split_header_lines(lines):
+    date = None
+    keys = []
+    values = []
+    for line in lines:
+        if line[:1] == '#':
+            # The first comment line holds the date, unless it starts with '##'.
+            if date is None and line[:2] != '##':
+                date = parse_header_date(line[1:].strip())
+            continue
+        key, sep, value = line.partition('=')
+        if not sep:
+            continue
+        keys.append(key)
+        values.append(value.strip())
+    return date, tuple(keys), values
+
+
+def _get_header_layout(shape):
+    # Works out which dictionaries are needed for a header with keys `shape`,
+    # and the assignments (index of dictionary, key, index of item) that
+    # build the header, in order. Items are either values (index < len(shape))
+    # or dictionaries (index - len(shape)), the first dictionary being the root.
+    num_values = len(shape)
+    indices = {'': 0}
+    assignments = []
+
+    def get_node(prefix):
+        index = indices.get(prefix)
+        if index is None:
+            parent_prefix, _, name = prefix.rpartition('.')
+            parent = get_node(parent_prefix)
+            index = len(indices)
+            indices[prefix] = index
+            assignments.append((parent, name, num_values + index))
+        return index
+
+    for k, key in enumerate(shape):
+        prefix, _, leaf = key.rpartition('.')
+        assignments.append((get_node(prefix), leaf, k))
+    return len(indices), tuple(assignments)
+
+
+def _get_cached(cache, key):
+    with _header_cache_lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+    return value
+
+
+def _set_cached(cache, key, value):
+    if HEADER_CACHE_SIZE > 0:
+        with _header_cache_lock:
+            cache[key] = value
+            while len(cache) > HEADER_CACHE_SIZE:
+                cache.popitem(last=False)
+
+
+@lru_cache(maxsize=256)
+def parse_header_date(datestr):
+    """
+    Parses the date in the first line of header files. The formats in
+    :py:data:`HEADER_DATE_FORMATS` are tried in order; the first one that works
+    is moved to the front, since all files of an archive use the same format.
+
+    :param datestr: Date as written in header file, without leading '#'.
+    :type datestr: str
+    :return: :py:class:`datetime.datetime` instance.
+    """
+    for fmt in list(HEADER_DATE_FORMATS):
+        try:
+            if fmt == _DATE_FORMAT_WITH_ZONE_NAME:
+                # `%Z` only accepts a few time zone names (e.g. not 'CEST'),
+                # so the name is removed from the string instead.
+                split = datestr.split()
+                t = datetime.strptime(' '.join(split[:4] + split[5:]), '%a %b %d %H:%M:%S %Y')
+            else:
+                t = datetime.strptime(datestr, fmt)
+        except ValueError:
+            continue
+        with _header_cache_lock:
+            if fmt in HEADER_DATE_FORMATS:
+                HEADER_DATE_FORMATS.remove(fmt)
+                HEADER_DATE_FORMATS.insert(0, fmt)
+        return t
+    raise ValueError("Unknown date format in header file: '%s'" % datestr)
 
 
 def find_links_in_local_parameters(list_of_all_links, parameter_subset, link_keys, chain):
@@ -803,18 +2134,24 @@ def find_links_in_local_parameters(list_of_all_links, parameter_subset, link_key
                                                link_keys, copy_chain)
 
 
-def replace_links(links, local_parameters, shared_parameters):
+def replace_links(links, local_parameters, shared_parameters, targets=None):
+    # Replaces `links` in `local_parameters` by the parameters of `shared_parameters`
+    # they point to. Targets are remembered in `targets` per (link key, shared index);
+    # they are only merged key by key if local parameters have keys in common with them.
+    if targets is None:
+        targets = {}
     for chain in links:
         d = local_parameters
         for key in chain[:-1]:
             d = d[key]
-        if debug:
-            print(("keys_before = ", d.keys()))
         index = d.pop(chain[-1])['*']
-        merge(d, shared_parameters[chain[-1]][index])
-        if debug:
-            print(("keys_shared = ", shared_parameters[chain[-1]][index].keys()))
-            print(("keys_after = ", d.keys()))
+        target = targets.get((chain[-1], index))
+        if target is None:
+            target = targets[(chain[-1], index)] = shared_parameters[chain[-1]][index]
+        if d.keys().isdisjoint(target.keys()):
+            d.update(target)
+        else:
+            merge(d, target)
 
 
 # Took this function from stackoverflow's user andrew cooke at thread 
@@ -0,0 +1,212 @@
+"""
+Vectorised preprocessing of force curves: baseline subtraction, contact point estimation
+and tip-sample separation, computed for all curves of a force map (or of many archives)
+at once instead of curve by curve. Curves are passed as arrays of shape
+(..., num_points), one curve per row, padded with NaN as returned by
+:py:meth:`JPKMap.get_cube <jpkfile.JPKMap.get_cube>`, together with the number of
+valid points of each curve. See :py:func:`preprocess_map` and :py:func:`preprocess_files`.
+"""
+import numpy as np
+
+#: Conversions of the deflection channel to a distance (in m), see
+#: :py:meth:`JPKSegment.get_decoded_data <jpkfile.JPKSegment.get_decoded_data>`.
+DEFLECTION_CONVERSIONS = ('distance',)
+
+
+def preprocess_map(jpk_map, segment=0, height='height', deflection='vDeflection',
+                   force=True, **kwargs):
+    """
+    Preprocesses the curves of all pixels of a force map, see :py:func:`preprocess_curves`.
+    Results have the shape of the map's grid (see
+    :py:meth:`JPKMap.get_grid_shape <jpkfile.JPKMap.get_grid_shape>`); pixels missing
+    in the archive (or outside of its region of interest) have NaN results.
+
+    :param jpk_map: Force map.
+    :type jpk_map: JPKMap
+    :param segment: Index of the approach ('extend') segment.
+    :type segment: int
+    :param height: Name of the height channel.
+    :type height: str
+    :param deflection: Name of the deflection channel.
+    :type deflection: str
+    :param force: If ``True``, the deflection is also converted to force (by its
+     default conversions) and baseline corrected.
+    :type force: bool
+    :param kwargs: Passed on to :py:func:`preprocess_curves`.
+    :return: See :py:func:`preprocess_curves`.
+    """
+    heights, _, lengths = jpk_map.get_cube(height, segment)
+    # The deflection channel is read once and converted to distance and force.
+    raw = jpk_map.get_cube(deflection, segment, decode=False)[0]
+    conversion_sets = [DEFLECTION_CONVERSIONS] + (['auto'] if force else [])
+    conversions = jpk_map.get_conversion_cubes(deflection, segment, conversion_sets)
+    deflections = convert_cube(raw, lengths, *conversions[0][:2])
+    forces = convert_cube(raw, lengths, *conversions[1][:2]) if force else None
+    return preprocess_curves(heights, deflections, forces, lengths, **kwargs)
+
+
+def preprocess_files(jpk_files, segment=0, height='height', deflection='vDeflection',
+                     force=True, **kwargs):
+    """
+    Same as :py:func:`preprocess_map`, but for a list of archives (JPKFile instances,
+    or pixels of maps); results have shape (len(jpk_files),).
+    """
+    segments = [jpk_file.segments[segment] for jpk_file in jpk_files]
+    heights, lengths, _ = stack_curves(segments, height)
+    deflections = stack_curves(segments, deflection, DEFLECTION_CONVERSIONS)[0]
+    forces = stack_curves(segments, deflection)[0] if force else None
+    return preprocess_curves(heights, deflections, forces, lengths, **kwargs)
+
+
+def stack_curves(segments, channel, conversions_to_be_applied='auto'):
+    """
+    Returns decoded data of `channel` of all `segments` in one array.
+
+    :param segments: List of JPKSegment instances.
+    :param channel: Name of channel.
+    :type channel: str
+    :param conversions_to_be_applied: See
+     :py:meth:`JPKSegment.get_decoded_data <jpkfile.JPKSegment.get_decoded_data>`.
+    :return: Tuple with three items: (1) array of shape (len(segments), num_points),
+     padded with NaN, ``num_points`` being the maximum number of points;
+     (2) integer array holding the number of points per segment; (3) unit.
+    """
+    lengths = np.array([s.get_num_points() for s in segments], dtype=int)
+    curves = np.full((len(segments), lengths.max(initial=0)), np.nan)
+    units = set()
+    for k, s in enumerate(segments):
+        unit = s.get_decoded_data(channel, conversions_to_be_applied,
+                                  out=curves[k, :lengths[k], np.newaxis])[1]
+        units.add(unit)
+    if len(units) > 1:
+        msg = "ERROR in stack_curves!\nUnits of channel '%s'" % channel
+        msg += " do not match for all segments: %s\n" % ', '.join(sorted(units))
+        raise RuntimeError(msg)
+    return curves, lengths, units.pop() if units else 'digital'
+
+
+def convert_cube(raw, lengths, multipliers, offsets):
+    """
+    Converts raw data of all pixels of a force map, as returned by
+    :py:meth:`JPKMap.get_cube <jpkfile.JPKMap.get_cube>` with ``decode=False``, with
+    the conversions returned by
+    :py:meth:`JPKMap.get_conversion_cubes <jpkfile.JPKMap.get_conversion_cubes>`.
+    Points beyond `lengths` are NaN, as for decoded cubes.
+    """
+    cube = raw * multipliers + offsets
+    cube[~get_valid_mask(raw.shape[-1], lengths)] = np.nan
+    return cube
+
+
+def preprocess_curves(height, deflection, force=None, lengths=None, baseline_fraction=0.5,
+                      threshold=0.0):
+    """
+    Preprocesses force curves of the approach segment:
+
+     1. A line ``deflection = slope * height + offset`` (the baseline) is fitted to the
+        first `baseline_fraction` of the points of each curve, where the tip is assumed
+        to be far from the sample, and subtracted (the same is done for `force`).
+     2. The contact point is the last point whose corrected deflection is at most
+        `threshold` (see :py:func:`find_contact_points`).
+     3. The tip-sample separation is ``height + deflection`` (heights decrease towards
+        the sample, deflections increase when the tip is pushed), relative to its value
+        at the contact point: positive before contact, negative (indentation) after.
+
+    :param height: Heights (in m), array of shape (..., num_points).
+    :param deflection: Deflections (in m), array of the same shape.
+    :param force: Forces (in N), array of the same shape, or ``None``.
+    :param lengths: Number of valid points per curve, array of shape (...); by default,
+     all points are valid.
+    :param baseline_fraction: Fraction of each curve's points used for the baseline fit.
+    :type baseline_fraction: float
+    :param threshold: See :py:func:`find_contact_points`.
+    :return: Dictionary with items 'deflection' and 'force' (baseline corrected curves,
+     'force' only if given), 'separation' (curves), 'baseline_slope' and 'baseline_offset'
+     (of the deflection), 'contact_index', 'contact_height', 'contact_separation'
+     (absolute, before shifting it to 0) and 'lengths'. Items which are no curves have
+     the shape of the batch, (...).
+    """
+    height = np.asarray(height, dtype=float)
+    deflection = np.asarray(deflection, dtype=float)
+    if lengths is None:
+        lengths = np.full(height.shape[:-1], height.shape[-1])
+    lengths = np.asarray(lengths)
+    baseline_lengths = np.floor(lengths * baseline_fraction).astype(int)
+
+    slope, offset = fit_baselines(height, deflection, baseline_lengths)
+    deflection = subtract_baselines(height, deflection, slope, offset)
+    results = {'deflection': deflection, 'baseline_slope': slope, 'baseline_offset': offset}
+    if force is not None:
+        force = np.asarray(force, dtype=float)
+        results['force'] = subtract_baselines(height, force,
+                                              *fit_baselines(height, force, baseline_lengths))
+
+    contact = find_contact_points(deflection, lengths, threshold)
+    separation = height + deflection
+    contact_separation = take_points(separation, contact)
+    separation -= contact_separation[..., np.newaxis]
+    results.update({'separation': separation,
+                    'contact_index': contact,
+                    'contact_height': take_points(height, contact),
+                    'contact_separation': contact_separation,
+                    'lengths': lengths})
+    return results
+
+
+def fit_baselines(x, y, lengths):
+    """
+    Fits lines ``y = slope * x + offset`` to the first `lengths` points of each curve
+    by least squares.
+
+    :param x: Array of shape (..., num_points).
+    :param y: Array of the same shape.
+    :param lengths: Number of points to fit per curve, array of shape (...).
+    :return: Tuple (slope, offset) of arrays of shape (...); NaN for curves with
+     less than two points.
+    """
+    mask = get_valid_mask(x.shape[-1], lengths)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n = mask.sum(axis=-1)
+        x_mean = np.where(mask, x, 0.0).sum(axis=-1) / n
+        y_mean = np.where(mask, y, 0.0).sum(axis=-1) / n
+        dx = np.where(mask, x - x_mean[..., np.newaxis], 0.0)
+        dy = np.where(mask, y - y_mean[..., np.newaxis], 0.0)
+        slope = (dx * dy).sum(axis=-1) / (dx * dx).sum(axis=-1)
+    return slope, y_mean - slope * x_mean
+
+
+def subtract_baselines(x, y, slope, offset):
+    """Returns `y` minus the lines ``slope * x + offset``, one per curve."""
+    return y - (slope[..., np.newaxis] * x + offset[..., np.newaxis])
+
+
+def find_contact_points(deflection, lengths, threshold=0.0):
+    """
+    Returns the index of the contact point of each curve of the approach segment, i.e.
+    of the last valid point whose (baseline corrected) deflection is at most `threshold`;
+    from there on, the deflection rises because the tip is pushed by the sample.
+    Curves without such a point get index 0.
+
+    :param deflection: Baseline corrected deflections, array of shape (..., num_points).
+    :param lengths: Number of valid points per curve, array of shape (...).
+    :param threshold: Deflection below which the tip is considered free.
+    :return: Integer array of shape (...).
+    """
+    num_points = deflection.shape[-1]
+    free = (deflection <= threshold) & get_valid_mask(num_points, lengths)
+    last = num_points - 1 - np.argmax(free[..., ::-1], axis=-1)
+    return np.where(free.any(axis=-1), last, 0)
+
+
+def take_points(curves, indices):
+    """Returns the value of each curve (array of shape (..., num_points)) at `indices`
+    (array of shape (...)), NaN for curves without points."""
+    if curves.shape[-1] == 0:
+        return np.full(curves.shape[:-1], np.nan)
+    return np.take_along_axis(curves, indices[..., np.newaxis], axis=-1)[..., 0]
+
+
+def get_valid_mask(num_points, lengths):
+    """Returns a boolean array of shape (..., num_points), ``True`` for the first
+    `lengths` (array of shape (...)) points of each curve."""
+    return np.arange(num_points) < np.asarray(lengths)[..., np.newaxis]
@@ -0,0 +1,104 @@
+"""
+Min/max decimation pyramids of channel data, so that long recordings can be plotted
+without processing all of their points each time, see :py:class:`MinMaxPyramid` and
+:py:meth:`JPKSegment.get_envelope <jpkfile.JPKSegment.get_envelope>`.
+"""
+import numpy as np
+
+#: Number of blocks of one level of a :py:class:`MinMaxPyramid` combined into one
+#: block of the next level.
+PYRAMID_FACTOR = 8
+
+
+class MinMaxPyramid:
+    """
+    Minima and maxima of blocks of consecutive points of a channel at several
+    resolutions. Level ``k`` holds minimum and maximum of each block of
+    ``factor ** (k + 1)`` points (the last block of a level may be shorter);
+    levels are added until a level has at most `factor` blocks.
+    Pyramids are built from raw (digital) data, so they do not depend on the
+    conversions applied later.
+
+    :param data: Data of the channel, a one-dimensional or single-column array.
+    :param factor: Number of blocks combined from one level to the next.
+    :type factor: int
+    """
+    def __init__(self, data, factor=PYRAMID_FACTOR):
+        """Constructor."""
+        #: Number of blocks combined from one level to the next.
+        self.factor = factor
+        #: Number of points of the channel.
+        self.num_points = len(data)
+        #: List of tuples (minima, maxima) of blocks, one per level.
+        self.levels = []
+        minima = maxima = np.asarray(data).ravel()
+        while len(minima) > factor:
+            minima = _reduce_blocks(np.minimum, minima, factor)
+            maxima = _reduce_blocks(np.maximum, maxima, factor)
+            self.levels.append((minima, maxima))
+
+    def get_block_size(self, level):
+        """Returns the number of points per block of `level`."""
+        return self.factor ** (level + 1)
+
+    def get_envelope(self, start, stop, max_points):
+        """
+        Returns minima and maxima of the blocks covering points `start` to `stop`
+        (exclusive) at the finest level having at most `max_points` blocks in this range,
+        or at the coarsest level. Blocks at the edges may include points outside of
+        the range.
+
+        :return: Tuple with three items: (1) index of the first point of each block
+         (at least `start`); (2) minima; (3) maxima.
+        """
+        if not self.levels:
+            raise RuntimeError("Pyramid of %i points has no levels." % self.num_points)
+        for level in range(len(self.levels)):
+            block_size = self.get_block_size(level)
+            first, last = start // block_size, -(-stop // block_size)
+            if last - first <= max_points:
+                break
+        minima, maxima = self.levels[level]
+        indices = np.arange(first, last) * block_size
+        if len(indices):
+            indices[0] = max(indices[0], start)
+        return indices, minima[first:last], maxima[first:last]
+
+    def to_array(self):
+        """Returns all levels in one array of shape (2, total number of blocks),
+        e.g. to store the pyramid; see :py:meth:`from_array`."""
+        if not self.levels:
+            return np.empty((2, 0))
+        return np.array([np.concatenate([minima for minima, _ in self.levels]),
+                         np.concatenate([maxima for _, maxima in self.levels])])
+
+    @classmethod
+    def from_array(cls, array, num_points, factor=PYRAMID_FACTOR):
+        """Returns a pyramid of `num_points` points from `array` as returned by
+        :py:meth:`to_array`. Levels are views on `array`."""
+        pyramid = cls(np.empty(0), factor)
+        pyramid.num_points = num_points
+        start = 0
+        length = num_points
+        while length > factor:
+            length = -(-length // factor)
+            pyramid.levels.append((array[0, start:start + length],
+                                   array[1, start:start + length]))
+            start += length
+        if start != array.shape[1]:
+            raise RuntimeError("Array of %i blocks does not match a pyramid of %i points."
+                               % (array.shape[1], num_points))
+        return pyramid
+
+
+def _reduce_blocks(ufunc, values, factor):
+    # Reduces each block of `factor` values with `ufunc`; the last block may be shorter.
+    # Combining strided columns is much faster than reducing along the short axis.
+    n = len(values) // factor * factor
+    blocks = values[:n].reshape(-1, factor)
+    reduced = blocks[:, 0].astype(values.dtype.newbyteorder('='))
+    for k in range(1, factor):
+        ufunc(reduced, blocks[:, k], out=reduced)
+    if n < len(values):
+        reduced = np.append(reduced, ufunc.reduce(values[n:]))
+    return reduced
@@ -0,0 +1,124 @@
+"""Instrumentation of reading JPK archives, see :py:class:`LoadStats`."""
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+#: Phases of reading archives recorded by :py:class:`LoadStats`:
+#:
+#:  * 'listing': opening the zip archive and reading its list of files,
+#:  * 'header': reading and parsing header files (bytes are counted for segment headers),
+#:  * 'links': resolving links of segment headers to the shared header,
+#:  * 'reading': reading (and inflating) data files,
+#:  * 'extraction': converting binary content to numpy arrays (:py:func:`~jpkfile.extract_data`),
+#:  * 'conversion': applying conversions to physical units.
+PHASES = ('listing', 'header', 'links', 'reading', 'extraction', 'conversion')
+
+
+class LoadStats:
+    """
+    Records wall time, number of calls, number of bytes and, optionally, peak memory
+    allocation per phase (see :py:data:`PHASES`) of reading archives. Pass an instance
+    as `stats` to :py:class:`~jpkfile.JPKFile` or :py:class:`~jpkfile.JPKMap`; the
+    same instance may be used for many archives to sum up their numbers, also
+    from many threads (peak memory is then recorded across threads).
+
+    :param trace_memory: If ``True``, the peak of memory allocated during each phase
+     is recorded with :py:mod:`tracemalloc`, which is started if necessary.
+     This slows down reading considerably.
+    :type trace_memory: bool
+    :param hooks: List of callables, called as ``hook(phase, seconds, nbytes)`` after
+     each recorded call, e.g. to export the numbers to monitoring systems.
+    """
+    def __init__(self, trace_memory=False, hooks=None):
+        """Constructor."""
+        #: ``True`` if peak memory allocation is recorded.
+        self.trace_memory = trace_memory
+        #: List of callables called after each recorded call.
+        self.hooks = list(hooks) if hooks else []
+        #: Dictionary assigning dictionaries with keys 'time' (seconds), 'calls',
+        #: 'bytes' and 'peak_memory' (bytes) to phases.
+        self.phases = {phase: _new_record() for phase in PHASES}
+        self._lock = threading.Lock()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def measure(self, phase):
+        """
+        Context manager recording one call of `phase`. Bytes processed are
+        added with :py:meth:`add_bytes` within the context.
+        """
+        with self._lock:
+            record = self.phases.setdefault(phase, _new_record())
+            bytes_before = record['bytes']
+        if self.trace_memory:
+            memory_before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                record['time'] += elapsed
+                record['calls'] += 1
+                if self.trace_memory:
+                    peak = tracemalloc.get_traced_memory()[1] - memory_before
+                    record['peak_memory'] = max(record['peak_memory'], peak)
+                nbytes = record['bytes'] - bytes_before
+            for hook in self.hooks:
+                hook(phase, elapsed, nbytes)
+
+    def add_bytes(self, phase, nbytes):
+        """Adds `nbytes` to the number of bytes processed in `phase`."""
+        with self._lock:
+            self.phases.setdefault(phase, _new_record())['bytes'] += nbytes
+
+    def merge(self, other):
+        """Adds the numbers recorded by `other` (:py:class:`LoadStats`) to this instance."""
+        with self._lock:
+            for phase, other_record in other.phases.items():
+                record = self.phases.setdefault(phase, _new_record())
+                for key in ('time', 'calls', 'bytes'):
+                    record[key] += other_record[key]
+                record['peak_memory'] = max(record['peak_memory'],
+                                            other_record['peak_memory'])
+
+    def as_dict(self):
+        """Returns a copy of :py:attr:`phases`, e.g. to export it."""
+        return {phase: dict(record) for phase, record in self.phases.items()}
+
+    def reset(self):
+        """Sets all numbers back to zero."""
+        self.phases = {phase: _new_record() for phase in PHASES}
+
+    def __getstate__(self):
+        # Hooks (and the lock) are not sent to worker processes.
+        state = self.__dict__.copy()
+        state['hooks'] = []
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        lines = ["%-12s%10s%8s%14s%14s" % ('PHASE', 'TIME [s]', 'CALLS', 'BYTES', 'PEAK MEMORY')]
+        for phase, record in self.phases.items():
+            lines.append("%-12s%10.4f%8i%14i%14i" % (phase, record['time'], record['calls'],
+                                                      record['bytes'], record['peak_memory']))
+        return '\n'.join(lines)
+
+
+def measure(self, phase):
+    """Returns the context manager recording `phase` in ``self.stats``, or a context
+    manager doing nothing if ``self.stats`` is ``None``."""
+    if self.stats is None:
+        return nullcontext()
+    return self.stats.measure(phase)
+
+
+def _new_record():
+    return {'time': 0.0, 'calls': 0, 'bytes': 0, 'peak_memory': 0}
@@ -0,0 +1,66 @@
+"""Streaming of segments of many JPK archives, see :py:func:`iter_segments`."""
+import warnings
+from .jpkfile import JPKFile, JPKMap
+from .catalog import find_archives
+
+
+def iter_segments(paths, channels=None, decode=True, segments=None, dtype=None, layout='dict'):
+    """
+    Yields data of all segments of many archives, one segment at a time. Archives
+    are opened lazily one after the other, data of a segment is read when it is
+    yielded and released afterwards, and each archive is closed as soon as all its
+    segments have been yielded. Memory usage therefore does not grow with the
+    number of archives.
+
+    :param paths: Path, or list of paths, to archives or directories. Directories are
+     searched recursively for archives, and glob patterns are expanded, see
+     :py:func:`~jpkfile.catalog.find_archives`.
+    :param channels: List of channels to read. By default, all channels of each segment
+     are read. Segments lacking one of the channels are skipped with a warning.
+    :param decode: Determines whether data is to be decoded, see :py:meth:`JPKSegment.get_array`.
+    :type decode: bool
+    :param segments: List of segment indices to read; all segments by default.
+    :param dtype: Passed on to :py:meth:`JPKSegment.get_array`.
+    :param layout: Passed on to :py:meth:`JPKSegment.get_array`; by default, arrays
+     are returned in a dictionary.
+    :type layout: str
+    :return: Generator of tuples (path, segment_index, arrays, units, parameters), with
+     `arrays` and `units` as returned by :py:meth:`JPKSegment.get_array` and the
+     segment's `parameters`. For force maps, `segment_index` is a tuple
+     (flat pixel index, segment index).
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    for path in find_archives(paths):
+        if path.endswith('.jpk-force-map'):
+            jpk_map = JPKMap(path, lazy=True, channels=channels, segments=segments)
+            try:
+                for index in sorted(jpk_map.flat_indices):
+                    jpk_file = jpk_map.flat_indices[index]
+                    for i, values in _iter_file_segments(path, jpk_file, channels, decode,
+                                                         dtype, layout):
+                        yield (path, (index, i)) + values
+                    del jpk_map.flat_indices[index]
+            finally:
+                jpk_map.jpk_zip.close()
+        else:
+            jpk_file = JPKFile(path, lazy=True, channels=channels, segments=segments)
+            try:
+                for i, values in _iter_file_segments(path, jpk_file, channels, decode,
+                                                     dtype, layout):
+                    yield (path, i) + values
+            finally:
+                jpk_file.jpk_zip.close()
+
+
+def _iter_file_segments(path, jpk_file, channels, decode, dtype, layout):
+    for i in sorted(jpk_file.segments):
+        segment = jpk_file.segments.pop(i)
+        segment_channels = list(segment.data) if channels is None else channels
+        missing = [c for c in segment_channels if c not in segment.data]
+        if missing:
+            warnings.warn("Skipping segment {} of '{}': channels {} not present.".format(
+                i, path, missing))
+            continue
+        arrays, units = segment.get_array(segment_channels, decode, dtype, layout)
+        yield i, (arrays, units, segment.parameters)
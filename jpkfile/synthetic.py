@@ -0,0 +1,207 @@
+"""
+Generator of synthetic JPK archives (.jpk-force, .jpk-nt-force and .jpk-force-map),
+e.g. to measure performance for archives of any size, see :py:func:`write_synthetic_archive`.
+The archives mimic the structure of archives recorded with JPK instruments, but only
+contain the header parameters read by this package.
+"""
+import os
+from zipfile import ZipFile, ZIP_DEFLATED
+import numpy as np
+
+#: Channels of synthetic archives: name -> (encoder multiplier, encoder offset,
+#: list of conversions (name, multiplier, offset, unit)), the conversions being
+#: applied in the given order after the encoder (which converts to 'V').
+SYNTHETIC_CHANNELS = {
+    'height': (1.5258789066052712e-3, 50.00000001164153,
+               [('nominal', -1.0e-6, 1.0e-4, 'm'), ('calibrated', 0.641378514, 0.0, 'm')]),
+    'vDeflection': (3.1192857358663316e-4, -0.024019620713206808,
+                    [('distance', 6.536262928004919e-8, 0.0, 'm'),
+                     ('force', 0.02333157301364864, 0.0, 'N')]),
+    'strainGaugeHeight': (3.112791053635462e-4, -0.02591920544731785,
+                          [('absolute', -1.0e-5, -5.3e-6, 'm'), ('nominal', 1.0, 1.0e-4, 'm')]),
+    'hDeflection': (3.1091580132753497e-4, -0.02200099209933642, []),
+    'error': (3.119285735866331e-4, 0.0, []),
+}
+
+_DATE_LINE = "#Wed Jun 15 13:17:28 CEST 2016\n"
+_SERIES_HEADER_TYPES = {'force': 'simple-force-scan-series-header',
+                        'nt-force': 'nt-force-scan-series-header'}
+
+
+def write_synthetic_archive(fname, num_segments=3, num_points=10000,
+                            channels=('height', 'vDeflection'), num_pixels=(4, 4),
+                            shared_header=None, compression=ZIP_DEFLATED, seed=0):
+    """
+    Writes a synthetic JPK archive. Its type is determined from the extension of
+    `fname`: '.jpk-force', '.jpk-nt-force' or '.jpk-force-map'.
+    Data of all channels is stored as 'short' (16 bit integers): 'height' ramps
+    down and up again, all other channels hold a deflection-like signal with noise.
+
+    :param fname: Path of the archive to write.
+    :type fname: str
+    :param num_segments: Number of segments (per pixel); the first one is an 'extend',
+     the last one a 'retract' segment, all others are 'pause' segments.
+    :type num_segments: int
+    :param num_points: Number of points of each segment.
+    :type num_points: int
+    :param channels: Names of channels, keys of :py:data:`SYNTHETIC_CHANNELS`.
+    :param num_pixels: Tuple (ilength, jlength) of the grid of force maps.
+    :param shared_header: If ``True``, channel parameters are stored once in
+     'shared-data/header.properties' and linked to by segment headers. By default,
+     this is done for '.jpk-nt-force' archives only.
+    :type shared_header: bool
+    :param compression: Compression of members, ``zipfile.ZIP_DEFLATED`` or
+     ``zipfile.ZIP_STORED``.
+    :param seed: Seed of the random noise.
+    :type seed: int
+    """
+    kind = os.path.splitext(fname)[1][len('.jpk-'):]
+    if kind not in ('force', 'nt-force', 'force-map'):
+        raise ValueError("Unknown archive type of '%s'." % fname)
+    if shared_header is None:
+        shared_header = kind == 'nt-force'
+    rng = np.random.default_rng(seed)
+    styles = ['extend'] + ['pause'] * (num_segments - 2) + ['retract']
+    styles = styles[:num_segments]
+
+    with ZipFile(fname, 'w', compression) as z:
+        if kind == 'force-map':
+            ilength, jlength = num_pixels
+            z.writestr('header.properties', get_map_header(ilength, jlength))
+            prefixes = ['index/%i/' % i for i in range(ilength * jlength)]
+        else:
+            prefixes = ['']
+        if shared_header:
+            z.writestr('shared-data/header.properties', get_shared_header(channels))
+        series_kind = 'nt-force' if kind == 'nt-force' else 'force'
+        for prefix in prefixes:
+            z.writestr(prefix + 'header.properties',
+                       get_series_header(series_kind, num_segments))
+            for k, style in enumerate(styles):
+                folder = prefix + 'segments/%i/' % k
+                z.writestr(folder + 'segment-header.properties',
+                           get_segment_header(style, num_points, channels, shared_header))
+                for c in channels:
+                    data = get_synthetic_data(c, style, num_points, rng)
+                    z.writestr(folder + 'channels/%s.dat' % c, data.astype('>i2').tobytes())
+
+
+def get_synthetic_data(channel, style, num_points, rng):
+    """Returns 16 bit integer data of `channel` in a segment of type `style`."""
+    if channel == 'height':
+        if style == 'pause':
+            return np.full(num_points, -30000, dtype=np.int16)
+        ramp = np.linspace(30000, -30000, num_points)
+        return (ramp if style == 'extend' else ramp[::-1]).astype(np.int16)
+    # Deflection rises linearly in contact, i.e. in the second half of the extend
+    # and the first half of the retract segment, and is constant while pausing.
+    contact = np.clip(np.linspace(-1.0, 1.0, num_points), 0.0, None) * 20000
+    if style == 'retract':
+        contact = contact[::-1]
+    elif style == 'pause':
+        contact = np.full(num_points, 20000.0)
+    noise = rng.normal(0.0, 50.0, num_points)
+    return (contact + noise).astype(np.int16)
+
+
+def get_map_header(ilength, jlength):
+    """Returns the top level header of a force map."""
+    return _DATE_LINE + _format_properties([
+        ('jpk-data-file', 'spm-forcemap'),
+        ('type', 'force-scan-map'),
+        ('force-scan-map.position-pattern.type', 'grid-position-pattern'),
+        ('force-scan-map.position-pattern.grid.ilength', ilength),
+        ('force-scan-map.position-pattern.grid.jlength', jlength),
+        ('force-scan-map.indexes.min', 0),
+        ('force-scan-map.indexes.max', ilength * jlength - 1),
+    ])
+
+
+def get_series_header(kind, num_segments):
+    """Returns the header of a force scan series ('force' or 'nt-force')."""
+    return _DATE_LINE + _format_properties([
+        ('jpk-data-file', 'spm-forcefile'),
+        ('type', 'force-scan-series'),
+        ('force-scan-series.force-segments.count', num_segments),
+        ('force-scan-series.header.type', _SERIES_HEADER_TYPES[kind]),
+        ('force-scan-series.description.comment', 'synthetic archive'),
+    ])
+
+
+def get_shared_header(channels):
+    """Returns a shared header holding parameters of `channels` as 'lcd-info' entries."""
+    properties = [('lcd-infos.count', len(channels))]
+    for k, c in enumerate(channels):
+        prefix = 'lcd-info.%i.' % k
+        properties += [(prefix + 'type', 'short-data'),
+                       (prefix + 'channel.type', 'channel'),
+                       (prefix + 'channel.name', c)]
+        properties += _get_channel_properties(c, prefix)
+    return _DATE_LINE + _format_properties(properties)
+
+
+def get_segment_header(style, num_points, channels, shared_header):
+    """Returns the header of a segment of type `style`."""
+    properties = [
+        ('force-segment-header.type', 'z-force-segment-header'),
+        ('force-segment-header.duration', num_points * 1.0e-4),
+        ('force-segment-header.num-points', num_points),
+        ('force-segment-header.name.type', 'standard'),
+        ('force-segment-header.name.name', style + '-synthetic'),
+        ('force-segment-header.settings.type', 'combined'),
+        ('force-segment-header.settings.style', style),
+        ('channels.list', ' '.join(channels)),
+    ]
+    for k, c in enumerate(channels):
+        prefix = 'channel.%s.' % c
+        properties += [(prefix + 'data.file.name', 'channels/%s.dat' % c),
+                       (prefix + 'data.file.format', 'raw')]
+        if shared_header:
+            properties += [(prefix + 'lcd-info.*', k),
+                           (prefix + 'data.num-points', num_points)]
+        else:
+            properties += [(prefix + 'data.type', 'short')]
+            properties += _get_channel_properties(c, prefix + 'data.', prefix)
+    return _DATE_LINE + _format_properties(properties)
+
+
+def _get_channel_properties(channel, encoder_prefix, conversion_prefix=None):
+    # Encoder and conversion set of `channel`, see `SYNTHETIC_CHANNELS`.
+    if conversion_prefix is None:
+        conversion_prefix = encoder_prefix
+    multiplier, offset, conversions = SYNTHETIC_CHANNELS[channel]
+    properties = _get_scaling_properties(encoder_prefix + 'encoder.', multiplier, offset, 'V')
+    properties.insert(0, (encoder_prefix + 'encoder.type', 'signedshort'))
+
+    prefix = conversion_prefix + 'conversion-set.'
+    properties += [
+        (prefix + 'conversions.list', ' '.join(name for name, _, _, _ in conversions)),
+        (prefix + 'conversions.default', conversions[-1][0] if conversions else 'volts'),
+        (prefix + 'conversions.base', 'volts'),
+        (prefix + 'conversion.volts.name', 'Volts'),
+        (prefix + 'conversion.volts.defined', 'false'),
+    ]
+    base = 'volts'
+    for name, multiplier, offset, unit in conversions:
+        conversion = prefix + 'conversion.%s.' % name
+        properties += [(conversion + 'name', name),
+                       (conversion + 'defined', 'true'),
+                       (conversion + 'type', 'simple'),
+                       (conversion + 'base-calibration-slot', base),
+                       (conversion + 'calibration-slot', name)]
+        properties += _get_scaling_properties(conversion, multiplier, offset, unit)
+        base = name
+    return properties
+
+
+def _get_scaling_properties(prefix, multiplier, offset, unit):
+    return [(prefix + 'scaling.type', 'linear'),
+            (prefix + 'scaling.style', 'offsetmultiplier'),
+            (prefix + 'scaling.offset', repr(offset)),
+            (prefix + 'scaling.multiplier', repr(multiplier)),
+            (prefix + 'scaling.unit.type', 'metric-unit'),
+            (prefix + 'scaling.unit.unit', unit)]
+
+
+def _format_properties(properties):
+    return ''.join('%s=%s\n' % (key, value) for key, value in properties)
@@ -20,9 +20,10 @@ setup(name='jpkfile',
       author_email='ilyasp.ku@gmail.com',
       license='MIT',
       entry_points={
-          "console_scripts": [],
+          "console_scripts": ["jpkfile=jpkfile.export:main"],
           "gui_scripts": []
       },
       install_requires=['numpy'],
+      extras_require={'hdf5': ['h5py'], 'parquet': ['pyarrow']},
       packages=['jpkfile'],
       zip_safe=False)